@@ -0,0 +1,179 @@
+# benchmark_crawler.py
+import json
+import time
+import shutil
+import asyncio
+import logging
+import tempfile
+import collections
+import multiprocessing
+from danmaku_crawler import DanmakuCrawler, RateLimiter
+from fake_seg_server import FakeSegServer
+
+
+def run_server(server_options, ready):
+    """子进程入口: 运行模拟弹幕接口，服务器的CPU开销不计入爬虫进程"""
+    server = FakeSegServer(**server_options)
+
+    async def serve():
+        await server.start()
+        ready.set()
+        while True:
+            await asyncio.sleep(3600)
+
+    asyncio.run(serve())
+
+
+def percentile(sorted_values, q):
+    """已排序数据的分位数(最近秩法)"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class CrawlerBenchmark:
+    """在本地模拟接口上运行 DanmakuCrawler，报告吞吐量、延迟分布和每个请求的CPU时间"""
+
+    def __init__(self, video_count=200, parts_per_video=1, server_options=None, crawler_options=None,
+                 rate_limit=500, keep_output=False):
+        """
+        初始化压测
+
+        参数:
+            video_count: 合成的视频数量
+            parts_per_video: 每个视频的分P数
+            server_options: 传给 FakeSegServer 的参数
+            crawler_options: 覆盖 DanmakuCrawler 的配置
+            rate_limit: 限速器的每秒请求数，应高于期望测得的吞吐量
+            keep_output: 是否保留爬取结果目录
+        """
+        self.video_count = video_count
+        self.parts_per_video = parts_per_video
+        self.server_options = dict(server_options or {})
+        self.crawler_options = crawler_options or {}
+        self.rate_limit = rate_limit
+        self.keep_output = keep_output
+
+    def write_cid_mapping(self, path):
+        """生成合成的CID映射，分段数由模拟接口的弹幕元数据给出"""
+        mapping = {}
+        for index in range(self.video_count):
+            aid = 100000 + index
+            parts = [
+                {'part_number': number, 'part_name': f"P{number}", 'cid': aid * 100 + number}
+                for number in range(1, self.parts_per_video + 1)
+            ]
+            mapping[f"https://www.bilibili.com/video/av{aid}"] = {
+                'aid': aid,
+                'bvid': f"BVbench{aid}",
+                'title': f"压测视频{index}",
+                'video_review': index,
+                'cid_info': {'main_cid': parts[0]['cid'], 'parts': parts}
+            }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(mapping, f, ensure_ascii=False)
+
+    def make_crawler(self, base_dir, api_base):
+        crawler = DanmakuCrawler(base_dir)
+        crawler.api_base = api_base
+        crawler.proxy_config = None        # 直接连接本地接口
+        crawler.min_delay = crawler.max_delay = 0
+        crawler.concurrent_requests = 32
+        crawler.adaptive_rate = False
+        crawler.request_timeout = 2
+        crawler.log_level = logging.WARNING
+        crawler.event_log = True           # 从事件流中统计每个请求的延迟
+        for name, value in self.crawler_options.items():
+            setattr(crawler, name, value)
+        return crawler
+
+    def run(self):
+        base_dir = tempfile.mkdtemp(prefix="danmaku-bench-")
+        server_options = dict({'port': 18080}, **self.server_options)
+        ready = multiprocessing.Event()
+        server_process = multiprocessing.Process(target=run_server, args=(server_options, ready), daemon=True)
+        server_process.start()
+        try:
+            if not ready.wait(30):
+                raise RuntimeError("模拟弹幕接口启动超时")
+
+            crawler = self.make_crawler(base_dir, f"http://127.0.0.1:{server_options['port']}")
+            self.write_cid_mapping(crawler.cid_mapping_file)
+
+            rate_limiter = RateLimiter(self.rate_limit)
+            wall_start = time.perf_counter()
+            cpu_start = time.process_time()
+            asyncio.run(crawler.process_cid_mapping_async(rate_limiter=rate_limiter))
+            cpu_time = time.process_time() - cpu_start
+            wall_time = time.perf_counter() - wall_start
+
+            report = self.build_report(crawler, wall_time, cpu_time)
+        finally:
+            server_process.terminate()
+            server_process.join()
+            if not self.keep_output:
+                shutil.rmtree(base_dir, ignore_errors=True)
+
+        self.print_report(report)
+        return report
+
+    def build_report(self, crawler, wall_time, cpu_time):
+        latencies = []
+        statuses = collections.Counter()
+        videos = 0
+        with open(crawler.event_log_file.format(worker_id=crawler.worker_id), 'r', encoding='utf-8') as f:
+            for line in f:
+                event = json.loads(line)
+                if event['event'] == 'request':
+                    statuses[event.get('status') or event.get('error')] += 1
+                    if event.get('status') == 200:
+                        latencies.append(event['latency'])
+                elif event['event'] == 'video':
+                    videos += 1
+
+        latencies.sort()
+        requests = sum(statuses.values())
+        return {
+            'videos': videos,
+            'requests': requests,
+            'wall_time': wall_time,
+            'cpu_time': cpu_time,
+            'videos_per_second': videos / wall_time if wall_time else 0.0,
+            'requests_per_second': requests / wall_time if wall_time else 0.0,
+            'latency_p50': percentile(latencies, 0.50),
+            'latency_p99': percentile(latencies, 0.99),
+            'cpu_ms_per_request': cpu_time / requests * 1000 if requests else 0.0,
+            'statuses': dict(statuses)
+        }
+
+    @staticmethod
+    def print_report(report):
+        print("\n压测结果")
+        print("=" * 40)
+        print(f"视频: {report['videos']} 个，请求: {report['requests']} 次，耗时 {report['wall_time']:.2f} 秒")
+        print(f"吞吐量: {report['videos_per_second']:.1f} 视频/秒，{report['requests_per_second']:.1f} 请求/秒")
+        print(f"成功请求延迟: p50 {report['latency_p50'] * 1000:.1f} ms，p99 {report['latency_p99'] * 1000:.1f} ms")
+        print(f"CPU: 共 {report['cpu_time']:.2f} 秒，每个请求 {report['cpu_ms_per_request']:.3f} ms")
+        print(f"响应状态: {report['statuses']}")
+
+
+def main():
+    # 根据实际情况修改: 视频数量、模拟接口的延迟和错误注入比例、爬虫配置
+    benchmark = CrawlerBenchmark(
+        video_count=200,
+        server_options={
+            'latency_median': 0.03,
+            'throttle_rate': 0.01,
+            'server_error_rate': 0.01,
+            'timeout_rate': 0.002,
+            'timeout_seconds': 5
+        },
+        crawler_options={'concurrent_requests': 32},
+        rate_limit=500
+    )
+    benchmark.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+# benchmark_parser.py
+import os
+import sys
+import json
+import time
+import pickle
+import tempfile
+import importlib
+import subprocess
+
+# protobuf 的实现在导入时确定，每种实现都在单独的子进程中测试
+PROTOBUF_BACKENDS = ("upb", "cpp", "python")
+
+# 自定义解码器: 名称 -> "模块:函数"，函数接收一个分段的原始数据，返回的对象可以用 len() 得到弹幕条数
+CUSTOM_DECODERS = {
+    'fast_decoder': "danmaku_fast_decoder:decode_segment",
+}
+
+
+def build_corpus(segment_count=32, danmaku_per_segment=300, seed=0):
+    """用模拟弹幕接口的生成逻辑合成分段数据"""
+    from fake_seg_server import FakeSegServer
+    server = FakeSegServer(danmaku_per_segment=danmaku_per_segment, payload_variants=segment_count, seed=seed)
+    return server.payloads
+
+
+def load_decoder(decoder):
+    """返回 (实际使用的protobuf实现, 解码函数)"""
+    if decoder == "protobuf":
+        from danmaku_parser import DanmakuParser
+        message_class = DanmakuParser.load_schema().DmSegMobileReply
+
+        def decode(data):
+            return message_class.FromString(data).elems
+        return DanmakuParser.protobuf_backend(), decode
+
+    module_name, function_name = CUSTOM_DECODERS[decoder].split(":")
+    return None, getattr(importlib.import_module(module_name), function_name)
+
+
+def run_worker(decoder, corpus_path, min_time):
+    """子进程入口: 反复解码整个语料，直到耗时超过 min_time 秒"""
+    with open(corpus_path, 'rb') as f:
+        corpus = pickle.load(f)
+    backend, decode = load_decoder(decoder)
+
+    # 预热一轮，同时统计弹幕条数
+    elems = sum(len(decode(data)) for data in corpus)
+    total_bytes = sum(len(data) for data in corpus)
+
+    rounds = 0
+    start = time.perf_counter()
+    while True:
+        for data in corpus:
+            decode(data)
+        rounds += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+
+    return {
+        'backend': backend,
+        'rounds': rounds,
+        'elapsed': elapsed,
+        'elems': elems * rounds,
+        'bytes': total_bytes * rounds,
+    }
+
+
+class ParserBenchmark:
+    """在每种可用的protobuf实现和每个自定义解码器下解析同一份合成语料，报告 弹幕/秒 和 MB/秒"""
+
+    def __init__(self, segment_count=32, danmaku_per_segment=300, min_time=2.0, backends=PROTOBUF_BACKENDS,
+                 custom_decoders=None):
+        """
+        初始化压测
+
+        参数:
+            segment_count: 语料中的分段数
+            danmaku_per_segment: 每个分段的弹幕条数
+            min_time: 每项测试的最短耗时(秒)
+            backends: 要测试的protobuf实现，不可用的实现会被跳过
+            custom_decoders: 要测试的自定义解码器名称，默认为 CUSTOM_DECODERS 中的全部
+        """
+        self.segment_count = segment_count
+        self.danmaku_per_segment = danmaku_per_segment
+        self.min_time = min_time
+        self.backends = backends
+        self.custom_decoders = list(CUSTOM_DECODERS) if custom_decoders is None else custom_decoders
+
+    def run_subprocess(self, decoder, corpus_path, backend=None):
+        env = dict(os.environ)
+        if backend:
+            env['PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION'] = backend
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", decoder, corpus_path, str(self.min_time)],
+            env=env, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        if completed.returncode != 0:
+            return None, completed.stderr.strip().splitlines()[-1:] or ["子进程异常退出"]
+        return json.loads(completed.stdout.strip().splitlines()[-1]), None
+
+    def run(self):
+        corpus = build_corpus(self.segment_count, self.danmaku_per_segment)
+        fd, corpus_path = tempfile.mkstemp(prefix="danmaku-corpus-", suffix=".pkl")
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(corpus, f)
+
+        print(f"语料: {len(corpus)} 个分段，每段 {self.danmaku_per_segment} 条弹幕，"
+              f"共 {sum(len(data) for data in corpus) / 1024 / 1024:.2f} MB")
+
+        results = []
+        try:
+            for backend in self.backends:
+                result, error = self.run_subprocess("protobuf", corpus_path, backend)
+                if result is None:
+                    print(f"protobuf[{backend}]: 不可用 ({error[0]})")
+                elif result['backend'] != backend:
+                    # 请求的实现不存在时 protobuf 可能静默回退到其他实现
+                    print(f"protobuf[{backend}]: 不可用 (实际使用 {result['backend']})")
+                else:
+                    results.append(self.summarize(f"protobuf[{backend}]", result))
+
+            for decoder in self.custom_decoders:
+                result, error = self.run_subprocess(decoder, corpus_path)
+                if result is None:
+                    print(f"{decoder}: 运行失败 ({error[0]})")
+                else:
+                    results.append(self.summarize(decoder, result))
+        finally:
+            os.remove(corpus_path)
+
+        self.print_report(results)
+        return results
+
+    @staticmethod
+    def summarize(name, result):
+        return {
+            'decoder': name,
+            'elems_per_second': result['elems'] / result['elapsed'],
+            'mb_per_second': result['bytes'] / result['elapsed'] / 1024 / 1024,
+            'rounds': result['rounds'],
+        }
+
+    @staticmethod
+    def print_report(results):
+        print("\n解析压测结果")
+        print("=" * 56)
+        print(f"{'解码器':<19}{'弹幕/秒':>14}{'MB/秒':>11}{'轮数':>6}")  # 中文字符按两列宽度对齐
+        for result in sorted(results, key=lambda item: -item['elems_per_second']):
+            print(f"{result['decoder']:<22}{result['elems_per_second']:>16,.0f}"
+                  f"{result['mb_per_second']:>12.1f}{result['rounds']:>8}")
+
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == "--worker":
+        print(json.dumps(run_worker(sys.argv[2], sys.argv[3], float(sys.argv[4]))))
+        return
+
+    # 根据实际情况修改: 语料规模和每项测试的耗时
+    benchmark = ParserBenchmark(segment_count=32, danmaku_per_segment=300, min_time=2.0)
+    benchmark.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# columnar_sink.py
+import os
+import time
+from typing import Any, Dict, List
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pq
+except ImportError:  # 列式输出为可选功能
+    pa = None
+
+# 输出列: (列名, DanmakuElem字段名)，与 DanmakuExtractor 生成的数据集字段保持一致
+# progress 单独转换为秒
+DANMAKU_ELEM_COLUMNS = [
+    ('content', 'content'),
+    ('mode', 'mode'),
+    ('font_size', 'fontsize'),
+    ('color', 'color'),
+    ('timestamp', 'ctime'),
+    ('weight', 'weight'),
+    ('pool', 'pool'),
+    ('mid_hash', 'midHash'),
+    ('dm_id', 'id'),
+]
+
+
+def _danmaku_schema():
+    return pa.schema([
+        ('progress', pa.float64()),  # 秒
+        ('content', pa.string()),
+        ('mode', pa.int32()),
+        ('font_size', pa.int32()),
+        ('color', pa.uint32()),
+        ('timestamp', pa.int64()),
+        ('weight', pa.int32()),
+        ('pool', pa.int32()),
+        ('mid_hash', pa.string()),
+        ('dm_id', pa.int64()),
+        ('video_id', pa.int64()),
+        ('video_title', pa.string()),
+        ('cid', pa.int64()),
+        ('part', pa.int32()),
+        ('segment', pa.int32()),
+        ('fetched_at', pa.int64()),  # 抓取时间(Unix时间戳)，同一分段被重新抓取时取最新的一份
+    ])
+
+
+class ColumnarDanmakuSink:
+    """
+    列式弹幕输出，将解析后的弹幕按列累积成批次，写入 Parquet 或 Arrow IPC 文件，
+    文件名为 {writer_id}-00000.parquet / {writer_id}-00000.arrow，达到行数上限后切换到下一个文件
+    """
+
+    def __init__(self, output_dir: str, file_format: str = "parquet", writer_id: str = "main",
+                 batch_rows: int = 65536, rows_per_file: int = 5_000_000):
+        """
+        初始化列式输出
+
+        参数:
+            output_dir: 输出目录
+            file_format: "parquet" 或 "arrow"
+            writer_id: 写入者标识，多个进程写同一目录时必须各不相同
+            batch_rows: 累积多少行写出一个批次
+            rows_per_file: 单个文件的行数上限
+        """
+        if pa is None:
+            raise ImportError("列式输出需要安装pyarrow: pip install pyarrow")
+        if file_format not in ("parquet", "arrow"):
+            raise ValueError(f"不支持的列式格式: {file_format}")
+
+        self.output_dir = output_dir
+        self.file_format = file_format
+        self.writer_id = writer_id
+        self.batch_rows = batch_rows
+        self.rows_per_file = rows_per_file
+        self.schema = _danmaku_schema()
+        os.makedirs(output_dir, exist_ok=True)
+
+        self._columns: Dict[str, List[Any]] = {name: [] for name in self.schema.names}
+        self._buffered_rows = 0
+        self._file_number = self._find_next_file_number()
+        self._writer = None
+        self._file_rows = 0
+
+    def _find_next_file_number(self) -> int:
+        """已有文件不再追加，从下一个文件号开始写"""
+        prefix, suffix = f"{self.writer_id}-", f".{self.file_format}"
+        numbers = [
+            int(name[len(prefix):-len(suffix)]) for name in os.listdir(self.output_dir)
+            if name.startswith(prefix) and name.endswith(suffix) and name[len(prefix):-len(suffix)].isdigit()
+        ]
+        return max(numbers) + 1 if numbers else 0
+
+    def _open_writer(self):
+        path = os.path.join(self.output_dir, f"{self.writer_id}-{self._file_number:05d}.{self.file_format}")
+        if self.file_format == "parquet":
+            return pq.ParquetWriter(path, self.schema)
+        return pa_ipc.new_file(path, self.schema)
+
+    def append_segment(self, metadata: Dict[str, Any], segment_index: int, danmaku_seg) -> int:
+        """追加一个已解析分段(DmSegMobileReply)的所有弹幕，返回弹幕条数"""
+        elems = danmaku_seg.elems
+        count = len(elems)
+        if count == 0:
+            return 0
+
+        columns = self._columns
+        columns['progress'].extend(elem.progress / 1000.0 for elem in elems)  # 转换为秒
+        for column, field in DANMAKU_ELEM_COLUMNS:
+            columns[column].extend(getattr(elem, field) for elem in elems)
+
+        fetched_at = int(time.time())
+        for column, value in (('video_id', metadata.get('aid')), ('video_title', metadata.get('title')),
+                              ('cid', metadata.get('cid')), ('part', metadata.get('part_number', 1)),
+                              ('segment', segment_index), ('fetched_at', fetched_at)):
+            columns[column].extend([value] * count)
+
+        self._buffered_rows += count
+        if self._buffered_rows >= self.batch_rows:
+            self.flush()
+        return count
+
+    def flush(self) -> None:
+        """将累积的行写出为一个批次"""
+        if self._buffered_rows == 0:
+            return
+
+        batch = pa.RecordBatch.from_pydict(self._columns, schema=self.schema)
+        self._columns = {name: [] for name in self.schema.names}
+        self._buffered_rows = 0
+
+        if self._writer is None:
+            self._writer = self._open_writer()
+        self._writer.write_batch(batch)
+        self._file_rows += batch.num_rows
+
+        if self._file_rows >= self.rows_per_file:
+            self._close_writer()
+
+    def _close_writer(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._file_number += 1
+            self._file_rows = 0
+
+    def close(self) -> None:
+        """写出剩余的行并关闭当前文件"""
+        self.flush()
+        self._close_writer()
@@ -0,0 +1,168 @@
+# crawl_launcher.py
+import os
+import time
+import asyncio
+import multiprocessing
+from danmaku_crawler import DanmakuCrawler
+
+
+# 跨进程共享的令牌桶限速器
+class SharedRateLimiter:
+    """
+    令牌桶状态保存在共享内存中，所有爬虫进程从同一个桶中领取令牌，
+    保证总请求速率不超过代理的限制。接口与 RateLimiter 相同，可以直接传给 DanmakuCrawler
+
+    max_rate 是速率的硬上限(默认为初始速率)，自适应限速调用 set_rate 时也不会超过
+    """
+
+    def __init__(self, rate_limit=5, burst=None, max_rate=None):
+        self.max_rate = max_rate or rate_limit
+        self._lock = multiprocessing.Lock()
+        self._rate = multiprocessing.Value('d', rate_limit, lock=False)        # 每秒请求数
+        self._burst = burst or rate_limit                                       # 令牌桶容量
+        self._tokens = multiprocessing.Value('d', self._burst, lock=False)      # 当前令牌数，预约后可以为负
+        self._last_check = multiprocessing.Value('d', time.monotonic(), lock=False)
+        self._last_decrease = multiprocessing.Value('d', float('-inf'), lock=False)
+
+        # 本进程的等待时间统计
+        self.acquire_count = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    @property
+    def rate_limit(self):
+        return self._rate.value
+
+    @property
+    def last_rate_decrease(self):
+        return self._last_decrease.value
+
+    def _refill(self, now):
+        """根据经过的时间恢复令牌 (调用方需持有锁)"""
+        self._tokens.value = min(self._burst, self._tokens.value + (now - self._last_check.value) * self._rate.value)
+        self._last_check.value = now
+
+    async def acquire(self):
+        """预约一个令牌并等待到它可用的时刻，返回本次等待的秒数"""
+        # 在锁内预约令牌: 令牌不足时计数变为负数，按预约顺序依次计算可用时间
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens.value -= 1
+            wait = max(0.0, -self._tokens.value / self._rate.value)
+
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                with self._lock:
+                    self._tokens.value += 1  # 归还未使用的预约
+                raise
+
+        self.acquire_count += 1
+        self.total_wait_time += wait
+        self.max_wait_time = max(self.max_wait_time, wait)
+        return wait
+
+    def set_rate(self, rate_limit):
+        """调整全局每秒请求数，对所有进程生效，不超过 max_rate"""
+        rate_limit = min(rate_limit, self.max_rate)
+        with self._lock:
+            self._refill(time.monotonic())
+            if rate_limit < self._rate.value:
+                self._last_decrease.value = time.monotonic()
+            self._rate.value = rate_limit
+
+    def wait_stats(self):
+        """返回本进程获取令牌的等待时间统计"""
+        return {
+            'acquire_count': self.acquire_count,
+            'waiting': 0,
+            'total_wait_time': self.total_wait_time,
+            'avg_wait_time': self.total_wait_time / self.acquire_count if self.acquire_count else 0.0,
+            'max_wait_time': self.max_wait_time
+        }
+
+
+def run_shard(shard_index, shard_count, base_dir, rate_limiter, crawler_options):
+    """子进程入口: 爬取 cid % shard_count == shard_index 的视频"""
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    crawler = DanmakuCrawler(base_dir)
+    for name, value in crawler_options.items():
+        setattr(crawler, name, value)
+
+    # 各进程使用独立的任务队列标识和分片写入器，避免互相覆盖
+    crawler.shard_index = shard_index
+    crawler.shard_count = shard_count
+    crawler.worker_id = f"shard{shard_index}"
+    crawler.pack_writer_id = f"shard{shard_index}"
+    # 自适应限速的上限就是全局预算: 不会超出预算，降速后也能恢复到预算
+    crawler.max_rate = rate_limiter.max_rate
+
+    asyncio.run(crawler.process_cid_mapping_async(rate_limiter=rate_limiter, prepare_queue=False))
+
+
+class CrawlLauncher:
+    """多进程爬取启动器，每个进程负责一部分cid，所有进程共享同一个请求速率预算"""
+
+    def __init__(self, base_dir="./data", process_count=None, total_rate=5, burst=None, crawler_options=None):
+        self.base_dir = base_dir
+        self.process_count = process_count or os.cpu_count() or 1
+        self.total_rate = total_rate            # 所有进程合计的每秒请求数
+        self.burst = burst
+        self.crawler_options = crawler_options or {}  # 传给每个进程中DanmakuCrawler的配置
+
+    def run(self):
+        """统一准备任务队列，然后启动所有爬虫进程并等待结束"""
+        crawler = DanmakuCrawler(self.base_dir)
+        for name, value in self.crawler_options.items():
+            setattr(crawler, name, value)
+
+        if not os.path.exists(crawler.cid_mapping_file):
+            print(f"错误: CID映射文件不存在: {crawler.cid_mapping_file}")
+            return
+
+        # 由启动器统一加入任务，避免各进程重复准备(例如增量重爬时重复重置已完成的视频)
+        crawler.prepare_work_queue().close()
+
+        rate_limiter = SharedRateLimiter(self.total_rate, self.burst)
+        processes = [
+            multiprocessing.Process(
+                target=run_shard,
+                args=(shard_index, self.process_count, self.base_dir, rate_limiter, self.crawler_options),
+                name=f"crawler-shard{shard_index}"
+            )
+            for shard_index in range(self.process_count)
+        ]
+
+        print(f"启动 {self.process_count} 个爬虫进程，共享每秒 {self.total_rate} 次的请求预算")
+        for process in processes:
+            process.start()
+
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            print("\n收到中断信号，正在停止所有爬虫进程...")
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
+
+        failed = [process.name for process in processes if process.exitcode != 0]
+        if failed:
+            print(f"以下进程异常退出: {', '.join(failed)}，重新运行即可从任务队列继续")
+        else:
+            print("所有爬虫进程已完成")
+
+
+def main():
+    # 根据实际情况修改: 进程数、所有进程合计的每秒请求数
+    launcher = CrawlLauncher(base_dir="./data", process_count=4, total_rate=20)
+    launcher.run()
+
+
+if __name__ == "__main__":
+    main()
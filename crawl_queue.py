@@ -0,0 +1,222 @@
+# crawl_queue.py
+import json
+import contextlib
+import time
+import sqlite3
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# 任务状态
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    cid INTEGER PRIMARY KEY,
+    aid INTEGER,
+    video_info TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    updated_at REAL,
+    last_error TEXT,
+    priority REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_videos_status ON videos (status);
+
+CREATE TABLE IF NOT EXISTS segments (
+    cid INTEGER NOT NULL,
+    segment INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    segment_info TEXT,
+    updated_at REAL,
+    PRIMARY KEY (cid, segment)
+);
+"""
+
+
+class CrawlQueue:
+    """
+    基于SQLite的持久化爬取任务队列，每个视频(cid)和每个分段(cid, 分段号)各有一行状态记录:
+    pending(待处理)、in_flight(处理中)、done(已完成)、failed(失败)，并记录尝试次数
+
+    多个爬虫进程可以共享同一个数据库文件，领取任务在写事务中完成，不会重复领取
+    """
+
+    def __init__(self, db_path: str, worker_id: str = "main", lease_timeout: float = 600):
+        """
+        初始化任务队列
+
+        参数:
+            db_path: SQLite数据库文件路径
+            worker_id: 当前爬虫进程的标识，多个进程共享队列时必须各不相同
+            lease_timeout: 处理中的任务超过此时间(秒)未续租，视为所属进程已退出；
+                运行中的进程应定期调用 renew_leases
+        """
+        self.db_path = db_path
+        self.worker_id = worker_id
+        self.lease_timeout = lease_timeout
+
+        # 自动提交模式，需要原子性的操作显式使用 BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+    
+    def _migrate(self):
+        """为旧版本创建的数据库补充新增的列"""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(videos)")}
+        if 'priority' not in columns:
+            self._conn.execute("ALTER TABLE videos ADD COLUMN priority REAL NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_videos_priority ON videos (status, priority DESC)")
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """写事务，开始时立即获取写锁，避免多个进程同时领取同一任务"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self._conn
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def enqueue_videos(self, video_infos: Iterable[Dict[str, Any]],
+                       priority: Optional[Callable[[Dict[str, Any]], float]] = None) -> int:
+        """
+        加入新视频(分P)任务(按cid去重，已存在的任务保持原状态)，返回新增数量
+
+        指定 priority 时用它计算每个任务的优先级(越大越先领取)，已存在的任务也会更新优先级
+        """
+        now = time.time()
+        rows = []
+        for video_info in video_infos:
+            cid = video_info.get('cid') or video_info.get('cid_info', {}).get('main_cid')
+            if cid:
+                rows.append((cid, video_info.get('aid'), json.dumps(video_info, ensure_ascii=False), now,
+                             priority(video_info) if priority else 0.0))
+
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO videos (cid, aid, video_info, updated_at, priority) VALUES (?, ?, ?, ?, ?)", rows
+            )
+            added = conn.total_changes - before
+            if priority:
+                conn.executemany("UPDATE videos SET priority = ? WHERE cid = ?", [(row[4], row[0]) for row in rows])
+            return added
+    
+    def finished_times(self) -> Dict[int, float]:
+        """返回已完成视频的完成时间(Unix时间戳)，用于计算距上次抓取的时间"""
+        return dict(self._conn.execute("SELECT cid, updated_at FROM videos WHERE status = ?", (DONE,)).fetchall())
+
+    def release_stale(self) -> int:
+        """将本进程遗留的、以及租约已过期的处理中任务重新置为待处理，返回数量"""
+        expired = time.time() - self.lease_timeout
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE videos SET status = ?, worker = NULL WHERE status = ? AND (worker = ? OR updated_at < ?)",
+                (PENDING, IN_FLIGHT, self.worker_id, expired)
+            )
+            conn.execute(
+                "UPDATE segments SET status = ? WHERE status = ? AND cid NOT IN "
+                "(SELECT cid FROM videos WHERE status = ?)",
+                (PENDING, IN_FLIGHT, IN_FLIGHT)
+            )
+            return cursor.rowcount
+
+    def renew_leases(self) -> int:
+        """续租本进程所有处理中的视频任务(心跳)，包括已领取但还在本地队列中等待的任务，返回数量"""
+        cursor = self._conn.execute(
+            "UPDATE videos SET updated_at = ? WHERE status = ? AND worker = ?",
+            (time.time(), IN_FLIGHT, self.worker_id)
+        )
+        return cursor.rowcount
+
+    def retry_failed(self, max_attempts: int) -> int:
+        """将尝试次数未达上限的失败视频重新置为待处理，返回数量(已完成的分段不会重复获取)"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE videos SET status = ? WHERE status = ? AND attempts < ?",
+                (PENDING, FAILED, max_attempts)
+            )
+            return cursor.rowcount
+
+    def reopen_done(self) -> int:
+        """将已完成的视频重新置为待处理(用于增量重爬)，返回数量"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM segments WHERE cid IN (SELECT cid FROM videos WHERE status = ?)", (DONE,))
+            cursor = conn.execute("UPDATE videos SET status = ? WHERE status = ?", (PENDING, DONE))
+            return cursor.rowcount
+
+    def claim_videos(self, limit: int = 1, shard_index: int = 0,
+                     shard_count: int = 1) -> List[Tuple[int, float, Dict[str, Any]]]:
+        """领取最多 limit 个待处理的视频任务并标记为处理中，按优先级从高到低返回 (cid, 优先级, 视频信息)
+
+        优先级相同时按加入顺序领取；多进程分片爬取时只领取 cid % shard_count == shard_index 的视频
+        """
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT cid, priority, video_info FROM videos WHERE status = ? AND cid % ? = ? "
+                "ORDER BY priority DESC, rowid LIMIT ?",
+                (PENDING, shard_count, shard_index, limit)
+            ).fetchall()
+
+            now = time.time()
+            conn.executemany(
+                "UPDATE videos SET status = ?, attempts = attempts + 1, worker = ?, updated_at = ? WHERE cid = ?",
+                [(IN_FLIGHT, self.worker_id, now, row[0]) for row in rows]
+            )
+            return [(cid, priority, json.loads(video_info)) for cid, priority, video_info in rows]
+
+    def finish_video(self, cid: int, success: bool, error: Optional[str] = None) -> None:
+        """记录视频任务的最终状态"""
+        self._conn.execute(
+            "UPDATE videos SET status = ?, worker = NULL, updated_at = ?, last_error = ? WHERE cid = ?",
+            (DONE if success else FAILED, time.time(), error, cid)
+        )
+
+    def done_segments(self, cid: int) -> Dict[int, Dict[str, Any]]:
+        """返回该视频已完成的分段及其元数据记录"""
+        rows = self._conn.execute(
+            "SELECT segment, segment_info FROM segments WHERE cid = ? AND status = ?", (cid, DONE)
+        ).fetchall()
+        return {segment: json.loads(segment_info) if segment_info else {} for segment, segment_info in rows}
+
+    def start_segments(self, cid: int, segment_indexes: List[int]) -> None:
+        """将分段标记为处理中并增加尝试次数，同时续租该视频任务"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("UPDATE videos SET updated_at = ? WHERE cid = ? AND worker = ?", (now, cid, self.worker_id))
+            conn.executemany(
+                "INSERT INTO segments (cid, segment, status, attempts, updated_at) VALUES (?, ?, ?, 1, ?) "
+                "ON CONFLICT (cid, segment) DO UPDATE SET status = excluded.status, "
+                "attempts = attempts + 1, updated_at = excluded.updated_at",
+                [(cid, segment_index, IN_FLIGHT, now) for segment_index in segment_indexes]
+            )
+
+    def finish_segment(self, cid: int, segment_index: int, success: bool,
+                       segment_info: Optional[Dict[str, Any]] = None) -> None:
+        """记录分段的最终状态，成功时保存该分段的元数据记录"""
+        self._conn.execute(
+            "UPDATE segments SET status = ?, segment_info = ?, updated_at = ? WHERE cid = ? AND segment = ?",
+            (DONE if success else FAILED,
+             json.dumps(segment_info, ensure_ascii=False) if segment_info is not None else None,
+             time.time(), cid, segment_index)
+        )
+
+    def counts(self, shard_index: int = 0, shard_count: int = 1) -> Dict[str, int]:
+        """按状态统计视频任务数量(可只统计指定分片)"""
+        rows = self._conn.execute(
+            "SELECT status, COUNT(*) FROM videos WHERE cid % ? = ? GROUP BY status", (shard_count, shard_index)
+        ).fetchall()
+        counts = {PENDING: 0, IN_FLIGHT: 0, DONE: 0, FAILED: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def close(self) -> None:
+        """关闭数据库连接"""
+        self._conn.close()
@@ -0,0 +1,120 @@
+# crawler_log.py
+import json
+import time
+import logging
+from tqdm import tqdm
+
+# 爬虫各模块共用的日志器名称，子模块使用 "crawler.xxx"
+LOGGER_NAME = "crawler"
+
+
+def get_logger(name=None):
+    """返回爬虫日志器(或其子日志器)"""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}" if name else LOGGER_NAME)
+
+
+def log_event(logger, level, event, message, *args, **fields):
+    """
+    记录一条结构化事件: message 按 % 格式化后输出到控制台，event 和 fields 写入JSONL事件流
+
+    级别未启用时直接返回，不构造日志记录也不格式化消息
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, message, *args, extra={'event': event, 'fields': fields})
+
+
+class TqdmConsoleHandler(logging.Handler):
+    """
+    通过 tqdm.write 输出到控制台，避免打乱进度条；每秒最多输出 max_per_second 条，
+    超出的记录不做格式化直接丢弃，并在下一条输出前提示省略的数量
+    """
+
+    def __init__(self, level=logging.INFO, max_per_second=20):
+        super().__init__(level)
+        self.max_per_second = max_per_second
+        self.setFormatter(logging.Formatter("%(message)s"))
+        self._window_start = 0.0
+        self._window_count = 0
+        self._suppressed = 0
+
+    def emit(self, record):
+        now = time.monotonic()
+        if now - self._window_start >= 1.0:
+            self._window_start = now
+            self._window_count = 0
+        if self.max_per_second and self._window_count >= self.max_per_second:
+            self._suppressed += 1
+            return
+        self._window_count += 1
+
+        try:
+            message = self.format(record)
+            if self._suppressed:
+                tqdm.write(f"  (控制台限流，省略了 {self._suppressed} 条日志)")
+                self._suppressed = 0
+            tqdm.write(message)
+        except Exception:
+            self.handleError(record)
+
+
+class JsonlEventHandler(logging.Handler):
+    """
+    将日志记录逐行写为JSON对象: {"time", "level", "event", ...fields}，
+    不带 event 的普通日志记为 "message" 事件并附上格式化后的消息
+    """
+
+    def __init__(self, path, level=logging.DEBUG):
+        super().__init__(level)
+        self.path = path
+        self._file = open(path, 'a', encoding='utf-8', buffering=1 << 16)
+
+    def emit(self, record):
+        try:
+            event = getattr(record, 'event', None)
+            line = {'time': round(record.created, 3), 'level': record.levelname}
+            if event is None:
+                line.update(event='message', message=record.getMessage())
+            else:
+                line['event'] = event
+                line.update(record.fields)
+            self._file.write(json.dumps(line, ensure_ascii=False) + "\n")
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        with self.lock:
+            if not self._file.closed:
+                self._file.flush()
+
+    def close(self):
+        with self.lock:
+            if not self._file.closed:
+                self._file.close()
+        super().close()
+
+
+def setup_logging(level=logging.INFO, console_rate=20, event_file=None, event_level=logging.DEBUG):
+    """
+    配置爬虫日志: 控制台输出 level 及以上的日志(每秒最多 console_rate 条)，
+    指定 event_file 时同时将 event_level 及以上的记录写入JSONL事件流；重复调用会替换之前的配置
+    """
+    logger = get_logger()
+    close_logging()
+
+    logger.addHandler(TqdmConsoleHandler(level, console_rate))
+    if event_file:
+        logger.addHandler(JsonlEventHandler(event_file, event_level))
+        level = min(level, event_level)
+
+    # 日志器级别取各输出的最低级别，低于此级别的调用在 isEnabledFor 处即被跳过
+    logger.setLevel(level)
+    logger.propagate = False
+    return logger
+
+
+def close_logging():
+    """刷新并关闭爬虫日志的所有输出"""
+    logger = get_logger()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
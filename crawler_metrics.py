@@ -0,0 +1,192 @@
+# crawler_metrics.py
+import os
+import json
+import time
+import bisect
+import collections
+from aiohttp import web
+
+# 耗时类直方图的默认分桶上界(秒)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """固定分桶的直方图，记录每个分桶的计数、总和与样本数"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)  # 最后一个为 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        """返回 (上界, 累计计数) 列表，与Prometheus的 _bucket 语义一致"""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.bucket_counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class CrawlerMetrics:
+    """
+    爬虫监控指标: 计数器、直方图和在读取时计算的仪表值，
+    可以输出为Prometheus文本格式(本地HTTP端点)或JSON快照(定期写入文件)
+
+    所有更新都在事件循环线程中进行，不需要加锁
+    """
+
+    def __init__(self):
+        self.start_time = time.monotonic()
+        self._counters = {}      # (名称, 标签) -> 数值
+        self._histograms = {}    # (名称, 标签) -> Histogram
+        self._gauges = {}        # 名称 -> 返回当前值的函数
+        self._help = {}
+        self._video_times = collections.deque()  # 最近一分钟内完成视频的时间，用于计算每分钟视频数
+
+        self.add_gauge('crawler_videos_per_minute', self.videos_per_minute, "最近一分钟完成的视频数")
+        self.add_gauge('crawler_uptime_seconds', lambda: time.monotonic() - self.start_time, "运行时长(秒)")
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items())) if labels else ()
+
+    def inc(self, name, value=1, **labels):
+        """计数器加 value"""
+        key = self._key(name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """向直方图中加入一个样本"""
+        key = self._key(name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def add_gauge(self, name, func, help_text=None):
+        """注册仪表值，读取指标时调用 func() 获取当前值"""
+        self._gauges[name] = func
+        if help_text:
+            self._help[name] = help_text
+
+    def record_video(self, success):
+        """记录一个视频处理完成"""
+        self.inc('crawler_videos_total', result='success' if success else 'failed')
+        self._video_times.append(time.monotonic())
+
+    def videos_per_minute(self):
+        cutoff = time.monotonic() - 60
+        while self._video_times and self._video_times[0] < cutoff:
+            self._video_times.popleft()
+        return len(self._video_times)
+
+    def _gauge_values(self):
+        values = {}
+        for name, func in self._gauges.items():
+            try:
+                values[name] = float(func())
+            except Exception:
+                continue  # 对应的组件尚未创建或已关闭
+        return values
+
+    @staticmethod
+    def _format_labels(labels, extra=None):
+        items = list(labels) + (extra or [])
+        if not items:
+            return ""
+        return "{" + ",".join(f'{name}="{value}"' for name, value in items) + "}"
+
+    def render_prometheus(self):
+        """输出Prometheus文本格式"""
+        lines = []
+        typed = set()
+
+        def declare(name, metric_type):
+            if name not in typed:
+                typed.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {metric_type}")
+
+        for (name, labels), value in sorted(self._counters.items()):
+            declare(name, "counter")
+            lines.append(f"{name}{self._format_labels(labels)} {value}")
+
+        for (name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+            declare(name, "histogram")
+            for bound, count in histogram.cumulative_counts():
+                le = "+Inf" if bound == float('inf') else repr(bound)
+                lines.append(f"{name}_bucket{self._format_labels(labels, [('le', le)])} {count}")
+            lines.append(f"{name}_sum{self._format_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{self._format_labels(labels)} {histogram.count}")
+
+        for name, value in sorted(self._gauge_values().items()):
+            declare(name, "gauge")
+            lines.append(f"{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """返回可序列化为JSON的指标快照，直方图附带平均值"""
+        def label_text(labels):
+            return ",".join(f"{name}={value}" for name, value in labels)
+
+        counters = collections.defaultdict(dict)
+        for (name, labels), value in self._counters.items():
+            counters[name][label_text(labels)] = value
+
+        histograms = collections.defaultdict(dict)
+        for (name, labels), histogram in self._histograms.items():
+            histograms[name][label_text(labels)] = {
+                'count': histogram.count,
+                'sum': round(histogram.sum, 6),
+                'avg': round(histogram.sum / histogram.count, 6) if histogram.count else 0.0,
+                'buckets': {"+Inf" if bound == float('inf') else str(bound): count
+                            for bound, count in histogram.cumulative_counts()}
+            }
+
+        return {
+            'time': time.time(),
+            'counters': counters,
+            'histograms': histograms,
+            'gauges': self._gauge_values()
+        }
+
+    def write_snapshot(self, path, snapshot=None):
+        """将指标快照写入JSON文件(先写临时文件再替换，读取方不会看到写了一半的内容)"""
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot or self.snapshot(), f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, path)
+
+
+class MetricsServer:
+    """在本地HTTP端口上以Prometheus文本格式提供指标: GET /metrics"""
+
+    def __init__(self, metrics, host="127.0.0.1", port=9100):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def _handle_metrics(self, request):
+        return web.Response(text=self.metrics.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -1,15 +1,38 @@
 # danmaku_crawler.py
 import os
 import json
+import math
+import hashlib
 import time
 import random
 import asyncio
+import collections
+import itertools
+import logging
+import functools
 import aiohttp
 import datetime
 from tqdm import tqdm
-from headers_pool import HeadersPool
+from headers_pool import HeadersPool, NO_CACHE_HEADERS
+from danmaku_parser import DanmakuParser
+from columnar_sink import ColumnarDanmakuSink
+from crawl_queue import CrawlQueue, PENDING, DONE, FAILED
+from retry_policy import RetryPolicy, CircuitBreaker, SUCCESS, PERMANENT, RETRYABLE, REJECTED
+from proxy_pool import ProxyPool, proxy_response_ok
+from crawler_metrics import CrawlerMetrics, MetricsServer
+from crawler_log import get_logger, log_event, setup_logging, close_logging
+from segment_pack import SegmentPackWriter, SegmentPackReader, DEFAULT_SHARD_SIZE
+from disk_writer import DiskWriter, write_bytes, write_json
 from aiohttp.client_exceptions import ClientError, ServerTimeoutError
 
+# 每个弹幕分段覆盖的视频时长(秒)
+SEGMENT_DURATION = 360
+
+# 元数据中抓取时间的格式
+FETCH_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+logger = get_logger()
+
 class DanmakuCrawler:
     def __init__(self, base_dir="./data"):
         # 基本配置
@@ -17,13 +40,26 @@ class DanmakuCrawler:
         self.danmaku_dir = os.path.join(base_dir, "弹幕数据")
         self.cid_mapping_file = os.path.join(base_dir, "视频CID映射.json")
         
-        # 爬取起始位置配置
-        self.start_index = 0  # 从第几条数据开始爬取
+        # 任务队列配置: 每个视频和分段的状态持久化在SQLite中，中断后可精确恢复
+        self.queue_file = os.path.join(base_dir, "crawl_queue.sqlite3")
+        self.worker_id = "main"  # 多个爬虫进程共享任务队列时必须各不相同
+        self.max_video_attempts = 3  # 失败视频的最大尝试次数
+        self.work_queue = None  # 运行时打开的CrawlQueue
+        
+        # 优先级调度: 优先级 = Σ 权重 x 指标，优先级高的视频先爬取，设为空字典时按CID映射中的顺序
+        # 可用指标: video_review(搜索结果中的弹幕数，取log10)、recency(发布越近越接近1)、
+        # staleness(距上次抓取的小时数，取log10，从未抓取视为一年)
+        self.priority_weights = {'video_review': 1.0}
+        
+        # 多进程分片: 本进程只处理 cid % shard_count == shard_index 的视频
+        self.shard_index = 0
+        self.shard_count = 1
         
         # 请求头池
-        self.headers_pool = HeadersPool()
+        self.headers_pool = HeadersPool(NO_CACHE_HEADERS)
+        self.header_strategy = "random"  # "random": 每个请求随机轮换身份；"sticky": 同一代理固定使用同一身份
         
-        # 代理配置 (使用时替换为你的隧道代理信息)
+        # 代理配置 (使用时替换为你的隧道代理信息，设为None时不使用代理)
         self.proxy_config = {
             "host": "your-proxy-host.com",
             "port": "12345",
@@ -31,39 +67,211 @@ class DanmakuCrawler:
             "pass": "your-password"
         }
         
+        # 代理池: 多个代理时每项一个配置(格式同proxy_config)，为空时只使用proxy_config；
+        # 按延迟和错误率加权选择代理，错误率过高的代理被隔离并在后台重新测试
+        self.proxy_configs = []
+        self.max_requests_per_proxy = 10  # 每个代理同时进行的请求数上限
+        self.proxy_pool = None  # 运行时创建的ProxyPool
+        
         # 请求配置
+        self.api_base = "https://api.bilibili.com"  # 弹幕接口地址，压测时指向本地的模拟服务器
         self.max_retries = 3  # 最大重试次数
         self.concurrent_requests = 5  # 并发请求数量
         self.request_timeout = 10  # 请求超时时间(秒)
         self.min_delay = 0.18  # 最小请求间隔(秒)
         self.max_delay = 0.22  # 最大请求间隔(秒)
+        self.rate_burst = None  # 令牌桶容量(允许的突发请求数)，None表示与每秒请求数相同
+        
+        # 重试与熔断: 按状态码类别决定是否重试(404等不重试)，退避时间为带随机抖动的指数增长，遵守Retry-After
+        # 最近请求的失败比例过高时熔断，暂停所有工作协程的请求；设为None关闭熔断
+        self.retry_policy = RetryPolicy()
+        self.circuit_breaker = CircuitBreaker()
+        
+        # 自适应限速(AIMD): 响应正常时线性提升请求速率，出现412/429/5xx或超时时按比例降低
+        # 初始速率为concurrent_requests，在[min_rate, max_rate]之间调整
+        self.adaptive_rate = True
+        self.min_rate = 1  # 速率下限(每秒请求数)
+        self.max_rate = 20  # 速率上限(每秒请求数)
+        self.rate_controller = None  # 运行时创建的AdaptiveRateController
+        
+        # 连接池配置
+        self.connection_limit = None  # 连接数上限，None表示按限速器的峰值速率推算
+        self.dns_cache_ttl = 300  # DNS缓存时间(秒)
+        self.keepalive_timeout = 30  # 空闲连接保持时间(秒)
+        self.session_pool_size = 1  # 会话数量(各自独立的连接池)，请求按轮询分配
+        
+        # 分段并发配置: 预先确定视频分段数，并同时请求所有分段
+        # 关闭时退回逐段顺序请求，直到遇到无效分段为止
+        self.segment_fanout = True
+        
+        # 存储格式: "files" 每个分段一个 弹幕数据/{aid}/segment_{n}.bin 文件
+        #          "pack"  分段数据依次追加到 弹幕分片/ 下的大分片文件，并记录紧凑索引
+        self.storage_format = "files"
+        self.pack_dir = os.path.join(base_dir, "弹幕分片")
+        self.pack_writer_id = "main"  # 多个爬虫进程写同一目录时必须各不相同
+        self.pack_shard_size = DEFAULT_SHARD_SIZE
+        self.pack_writer = None  # 运行时创建的SegmentPackWriter
+        
+        # 列式输出配置: 每个分段到达时立即解析，按列追加到 Parquet/Arrow IPC 文件(需要pyarrow)
+        self.columnar_output = False
+        self.columnar_format = "parquet"  # "parquet" 或 "arrow"
+        self.columnar_dir = os.path.join(base_dir, "弹幕列存")
+        self.keep_raw = True  # 开启列式输出时是否仍保存原始分段数据
+        self.columnar_sink = None  # 运行时创建的ColumnarDanmakuSink
+        
+        # 磁盘写入配置
+        self.writer_queue_size = 256  # 写入队列上限，磁盘跟不上时爬取在此等待
+        self.fsync_writes = False  # 每批写入后是否fsync，断电时更安全但更慢
+        self.disk_writer = None  # 运行时创建的DiskWriter
+        
+        # 日志配置
+        self.log_level = logging.INFO  # 控制台日志级别，设为logging.DEBUG可查看每个请求和分段的结果
+        self.console_log_rate = 20  # 控制台每秒最多输出的日志条数，0表示不限制
+        self.event_log = False  # 是否将结构化事件(每次请求的结果、耗时、重试等)写入JSONL事件流
+        self.event_log_file = os.path.join(base_dir, "crawl_events_{worker_id}.jsonl")
+        
+        # 监控指标配置
+        self.metrics = CrawlerMetrics()
+        self.metrics_port = None  # 设置后在 127.0.0.1:{metrics_port + shard_index}/metrics 提供Prometheus格式的指标
+        self.metrics_file = None  # 设置后定期将指标快照写入该JSON文件，可用 {worker_id} 占位
+        self.metrics_interval = 10  # 指标快照的写入间隔(秒)
+        
+        # 增量重爬配置: 根据上次保存的分段记录(抓取时间、内容哈希)只刷新可能变化的分段
+        self.incremental = False
+        self.refresh_ttl = 24 * 3600  # 距上次抓取不足此时间(秒)的分段直接跳过
+        self.stale_ttl = 30 * 24 * 3600  # 超过此时间(秒)未刷新的分段总是重新获取
+        self.recent_video_days = 7  # 发布不超过此天数的视频弹幕仍在增长，刷新所有分段
+        self.tail_segments = 1  # 较早的视频只刷新末尾的几个分段
+        self.previous_metadata = {}  # 打包存储时上次的元数据，按cid索引
         
         # 确保弹幕保存目录存在
         if not os.path.exists(self.danmaku_dir):
             os.makedirs(self.danmaku_dir)
     
     async def create_session(self):
-        """创建配置了代理的aiohttp会话"""
-        # 配置代理验证信息
-        proxy_url = f"http://{self.proxy_config['user']}:{self.proxy_config['pass']}@{self.proxy_config['host']}:{self.proxy_config['port']}"
+        """创建配置了连接池的aiohttp会话池"""
+        # 连接数按限速器的峰值速率推算: 在途连接数约为 速率 x 单次请求耗时
+        peak_rate = self.max_rate if self.adaptive_rate else self.concurrent_requests
+        connection_limit = self.connection_limit or max(self.concurrent_requests, math.ceil(peak_rate * 2))
+        session_count = max(1, self.session_pool_size)
+        per_session_limit = math.ceil(connection_limit / session_count)
         
-        # 更完整的请求头，更好地模拟浏览器行为
-        headers = self.headers_pool.get_random_headers()
+        sessions = []
+        for _ in range(session_count):
+            # 显式配置连接复用和DNS缓存，避免重复建立连接和TLS握手；请求头在每个请求上单独附加
+            connector = aiohttp.TCPConnector(
+                limit=per_session_limit,
+                limit_per_host=per_session_limit,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            
+            # 创建连接会话
+            sessions.append(aiohttp.ClientSession(connector=connector))
         
-        # 添加禁用缓存的请求头
-        headers.update({
-            'Cache-Control': 'no-cache, no-store, must-revalidate',
-            'Pragma': 'no-cache',
-            'Expires': '0'
-        })
+        return SessionPool(sessions)
+    
+    def select_headers(self, proxy):
+        """按配置的策略为本次请求选择请求头，返回池中预先构建好的只读请求头"""
+        if self.header_strategy == "sticky" and proxy is not None:
+            return self.headers_pool.get_headers(proxy.name)
+        return self.headers_pool.get_random_headers()
+    
+    async def fetch_with_retry(self, session, url, params, desc, rate_limiter=None):
+        """
+        带限速、熔断和重试的GET请求，成功时返回响应内容，多次重试仍失败或请求被拒绝时返回None；
+        资源不存在(404/410)时不再重试，返回空内容
+        """
+        endpoint = url.rsplit('/', 1)[-1]
+        cid, segment_index = params.get('oid'), params.get('segment_index')
+        backoff = 0.0
         
-        # 创建连接会话
-        session = aiohttp.ClientSession(headers=headers)
-        return session, proxy_url
+        for retry in range(self.max_retries):
+            if retry:
+                self.metrics.inc('crawler_retries_total', endpoint=endpoint)
+            
+            # 熔断期间所有请求在此等待
+            if self.circuit_breaker:
+                await self.circuit_breaker.wait_ready()
+            
+            # 每次尝试(包括重试)都要获取令牌，重试同样受整体速率限制
+            if rate_limiter:
+                self.metrics.observe('crawler_rate_limiter_wait_seconds', await rate_limiter.acquire())
+            
+            # 添加随机延迟，使请求更自然
+            delay = random.uniform(self.min_delay, self.max_delay)
+            await asyncio.sleep(delay)
+            self.metrics.observe('crawler_request_delay_seconds', delay)
+            
+            # 从代理池选择代理，请求结束后按结果更新该代理的健康状态
+            proxy = await self.proxy_pool.acquire() if self.proxy_pool else None
+            proxy_ok = False
+            start_time = time.monotonic()
+            retry_after = None
+            try:
+                async with session.get(
+                    url, 
+                    params=params, 
+                    headers=self.select_headers(proxy),
+                    proxy=proxy.url if proxy else None,
+                    timeout=aiohttp.ClientTimeout(total=self.request_timeout)
+                ) as response:
+                    if self.rate_controller:
+                        self.rate_controller.record_response(response.status)
+                    self.metrics.inc('crawler_requests_total', endpoint=endpoint, status=response.status)
+                    outcome = self.retry_policy.classify(response.status)
+                    proxy_ok = proxy_response_ok(response.status)
+                    if self.circuit_breaker:
+                        # 只有成功和资源不存在(404/410)不计为失败，封禁潮(401/403/407)会推高失败比例触发熔断
+                        self.circuit_breaker.record(outcome in (SUCCESS, PERMANENT))
+                    
+                    if outcome == SUCCESS:
+                        data = await response.read()
+                        self.metrics.inc('crawler_response_bytes_total', len(data), endpoint=endpoint)
+                        self.metrics.observe('crawler_request_latency_seconds', time.monotonic() - start_time,
+                                             endpoint=endpoint)
+                        if logger.isEnabledFor(logging.DEBUG):  # 每个请求都会执行，未启用时不构造事件字段
+                            log_event(logger, logging.DEBUG, 'request', "  请求成功 (%s, %d 字节)", desc, len(data),
+                                      endpoint=endpoint, cid=cid, segment=segment_index, status=response.status,
+                                      bytes=len(data), latency=round(time.monotonic() - start_time, 4), retry=retry)
+                        return data
+                    
+                    log_event(logger, logging.WARNING, 'request', "  HTTP错误: %d (%s, 重试: %d/%d)",
+                              response.status, desc, retry + 1, self.max_retries,
+                              endpoint=endpoint, cid=cid, segment=segment_index, status=response.status,
+                              latency=round(time.monotonic() - start_time, 4), retry=retry, outcome=outcome)
+                    if outcome == PERMANENT:
+                        return b""
+                    if outcome == REJECTED:
+                        return None  # 记为失败，下次运行时重试
+                    retry_after = self.retry_policy.parse_retry_after(response.headers.get('Retry-After'))
+            except Exception as e:
+                if self.rate_controller and isinstance(e, (asyncio.TimeoutError, ServerTimeoutError)):
+                    self.rate_controller.record_throttle()
+                self.metrics.inc('crawler_requests_total', endpoint=endpoint, status=type(e).__name__)
+                if self.circuit_breaker:
+                    self.circuit_breaker.record(False)
+                outcome = RETRYABLE
+                log_event(logger, logging.WARNING, 'request', "  请求时发生异常: %s (%s, 重试: %d/%d)",
+                          str(e)[:100], desc, retry + 1, self.max_retries,
+                          endpoint=endpoint, cid=cid, segment=segment_index, error=type(e).__name__,
+                          latency=round(time.monotonic() - start_time, 4), retry=retry)
+            finally:
+                if self.proxy_pool:
+                    self.proxy_pool.release(proxy, proxy_ok, time.monotonic() - start_time)
+            
+            if retry + 1 < self.max_retries:
+                # 指数退避并加入随机抖动，避免所有工作协程同时重试
+                backoff = self.retry_policy.next_delay(backoff, outcome, retry_after)
+                await asyncio.sleep(backoff)
+        
+        log_event(logger, logging.ERROR, 'request_failed', "  达到最大重试次数，请求失败: %s", desc,
+                  endpoint=endpoint, cid=cid, segment=segment_index, retries=self.max_retries)
+        return None
     
-    async def get_segment_danmaku(self, session, cid, segment_index=1, aid=None, proxy_url=None, rate_limiter=None):
+    async def get_segment_danmaku(self, session, cid, segment_index=1, aid=None, rate_limiter=None):
         """获取指定CID和分段的弹幕数据"""
-        url = 'https://api.bilibili.com/x/v2/dm/web/seg.so'
+        url = f'{self.api_base}/x/v2/dm/web/seg.so'
         params = {
             'type': 1,
             'oid': cid,
@@ -73,47 +281,220 @@ class DanmakuCrawler:
         if aid:
             params['pid'] = aid
         
-        # 等待获取令牌，控制请求速率
-        if rate_limiter:
-            await rate_limiter.acquire()
+        return await self.fetch_with_retry(
+            session, url, params, f"CID: {cid}, 分段: {segment_index}", rate_limiter
+        )
+    
+    async def get_danmaku_view(self, session, cid, aid=None, rate_limiter=None):
+        """获取弹幕元数据(DmWebViewReply)，其中包含视频的弹幕分段总数"""
+        url = f'{self.api_base}/x/v2/dm/web/view'
+        params = {
+            'type': 1,
+            'oid': cid
+        }
         
-        # 添加随机延迟，使请求更自然
-        await asyncio.sleep(random.uniform(self.min_delay, self.max_delay))
+        if aid:
+            params['pid'] = aid
         
-        for retry in range(self.max_retries):
-            try:
-                async with session.get(
-                    url, 
-                    params=params, 
-                    proxy=proxy_url,
-                    timeout=aiohttp.ClientTimeout(total=self.request_timeout)
-                ) as response:
-                    if response.status == 200:
-                        return await response.read()
-                    else:
-                        print(f"  HTTP错误: {response.status} (CID: {cid}, 分段: {segment_index}, 重试: {retry+1}/{self.max_retries})")
-                        # 服务器错误时增加等待时间
-                        if response.status >= 500:
-                            await asyncio.sleep(1 * (retry + 1))
-                        # 客户端错误，可能是请求过于频繁
-                        elif response.status >= 400:
-                            await asyncio.sleep(2 * (retry + 1))
-            except Exception as e:
-                print(f"  获取弹幕时发生异常: {str(e)[:100]} (CID: {cid}, 分段: {segment_index}, 重试: {retry+1}/{self.max_retries})")
-                await asyncio.sleep(1 * (retry + 1))  # 出错后等待，避免立即重试
+        view_data = await self.fetch_with_retry(
+            session, url, params, f"CID: {cid}, 元数据", rate_limiter
+        )
+        if not view_data:
+            return None
+        
+        try:
+            view_reply = DanmakuParser.load_schema().DmWebViewReply()
+            view_reply.ParseFromString(view_data)
+            return view_reply
+        except Exception as e:
+            logger.warning("  解析弹幕元数据失败: %s (CID: %s)", str(e)[:100], cid)
+            return None
+    
+    async def resolve_segment_count(self, session, video_info, cid, aid, rate_limiter, max_segments=100):
+        """确定视频的弹幕分段数，优先使用CID映射中的视频时长，其次请求弹幕元数据"""
+        # 分P任务带有该分P自己的时长
+        duration = video_info.get('duration', video_info.get('cid_info', {}).get('duration'))
+        if duration:
+            return min(max_segments, max(1, math.ceil(duration / SEGMENT_DURATION)))
+        
+        view_reply = await self.get_danmaku_view(session, cid, aid, rate_limiter)
+        if view_reply and view_reply.dm_sge.total > 0:
+            return min(max_segments, view_reply.dm_sge.total)
         
-        print(f"  达到最大重试次数，无法获取 CID: {cid}, 分段: {segment_index}")
         return None
     
-    async def save_raw_danmaku(self, session, video_info, rate_limiter, proxy_url, max_segments=100, pbar=None):
-        """保存指定视频的所有分段弹幕数据"""
-        cid = video_info.get('cid_info', {}).get('main_cid')
+    async def disk_submit(self, func, *args, key=None):
+        """提交磁盘操作，运行时交给写入线程执行(队列已满时等待)，否则直接执行；key 用于记录写入失败"""
+        if self.disk_writer:
+            start_time = time.monotonic()
+            await self.disk_writer.submit(func, *args, key=key)
+            self.metrics.observe('crawler_disk_wait_seconds', time.monotonic() - start_time, op='submit')
+        else:
+            func(*args)
+    
+    async def disk_call(self, func, *args):
+        """执行需要结果的磁盘操作，运行时在写入线程中按提交顺序执行"""
+        if self.disk_writer:
+            start_time = time.monotonic()
+            result = await self.disk_writer.call(func, *args)
+            self.metrics.observe('crawler_disk_wait_seconds', time.monotonic() - start_time, op='call')
+            return result
+        return func(*args)
+    
+    def append_columnar(self, metadata, segment_index, segment_data):
+        """解析分段并追加到列式输出"""
+        danmaku_seg = DanmakuParser.parse_danmaku_bytes(segment_data)
+        if danmaku_seg is not None:
+            self.columnar_sink.append_segment(metadata, segment_index, danmaku_seg)
+    
+    def write_failed(self, cid, segment_index):
+        """(写入线程中调用) 该分段此前提交的写入是否失败"""
+        return self.disk_writer is not None and (cid, segment_index) in self.disk_writer.failed_keys
+    
+    def finish_saved_segment(self, cid, segment_index, segment_info):
+        """(写入线程中调用) 分段数据写入成功后才在任务队列中记录完成，写入失败时记为失败，下次重新获取"""
+        if self.write_failed(cid, segment_index):
+            self.work_queue.finish_segment(cid, segment_index, False)
+        else:
+            self.work_queue.finish_segment(cid, segment_index, True, segment_info)
+    
+    def without_failed_writes(self, metadata):
+        """(写入线程中调用) 返回去掉写入失败分段的元数据副本，这些分段记为失败分段，下次不会被当作已保存而跳过"""
+        cid = metadata['cid']
+        failed = [segment_index for segment_index in metadata['segments'] if self.write_failed(cid, segment_index)]
+        if not failed:
+            return metadata
+        metadata = dict(metadata, segments=dict(metadata['segments']))
+        for segment_index in failed:
+            del metadata['segments'][segment_index]
+        metadata['failed_segments'] = sorted(set(metadata['failed_segments']) | set(failed))
+        return metadata
+    
+    def write_metadata_file(self, metadata_file, metadata):
+        """(写入线程中调用) 写入元数据文件"""
+        write_json(metadata_file, self.without_failed_writes(metadata), self.fsync_writes)
+    
+    def write_pack_metadata(self, metadata):
+        """(写入线程中调用) 把元数据追加到分片目录"""
+        self.pack_writer.write_metadata(self.without_failed_writes(metadata))
+    
+    def take_write_failures(self, cid):
+        """(写入线程中调用) 取出并清除该视频写入失败的分段序号"""
+        if self.disk_writer is None:
+            return []
+        keys = [key for key in self.disk_writer.failed_keys if key[0] == cid]
+        self.disk_writer.failed_keys.difference_update(keys)
+        return sorted(segment_index for _, segment_index in keys)
+    
+    async def save_segment(self, video_dir, segment_index, segment_data, metadata, previous_segment=None):
+        """保存单个分段的二进制数据并记录元数据，内容与上次抓取相同时不重复写入，返回是否写入"""
+        segment_start_time = (segment_index - 1) * 6  # 每段6分钟
+        fetch_time = datetime.datetime.now().strftime(FETCH_TIME_FORMAT)
+        content_hash = hashlib.sha1(segment_data).hexdigest()
+        
+        if previous_segment and previous_segment.get('sha1') == content_hash:
+            # 内容未变化: 沿用上次的存储位置，只更新抓取时间
+            metadata['segments'][segment_index] = dict(previous_segment, fetch_time=fetch_time)
+            return False
+        
+        segment_info = {
+            'size': len(segment_data),
+            'sha1': content_hash,
+            'fetch_time': fetch_time,
+            'start_time': f"{segment_start_time}:00",
+            'end_time': f"{segment_start_time + 6}:00"
+        }
+        
+        if self.columnar_sink:
+            # 边抓取边解析，直接追加到列式输出，省去之后单独的提取步骤
+            await self.disk_submit(self.append_columnar, metadata, segment_index, segment_data,
+                                   key=(metadata['cid'], segment_index))
+        
+        if not self.keep_raw:
+            pass  # 只保留列式输出，不保存原始数据
+        elif self.storage_format == "pack":
+            # 追加到分片文件，记录数据所在的分片和偏移
+            shard_number, offset, _ = await self.disk_call(
+                self.pack_writer.append, metadata['cid'], segment_index, segment_data
+            )
+            segment_info.update({'shard': shard_number, 'offset': offset})
+        else:
+            segment_file = os.path.join(video_dir, f"segment_{segment_index}.bin")
+            await self.disk_submit(write_bytes, segment_file, segment_data, self.fsync_writes,
+                                   key=(metadata['cid'], segment_index))
+            segment_info['file'] = segment_file
+        
+        metadata['segments'][segment_index] = segment_info
+        return True
+    
+    async def save_metadata(self, video_dir, metadata):
+        """保存视频元数据，返回保存位置"""
+        if self.storage_format == "pack":
+            await self.disk_submit(self.write_pack_metadata, metadata)
+            if not self.disk_writer:
+                self.pack_writer.flush()
+            return self.pack_writer.pack_dir
+        
+        metadata_file = os.path.join(video_dir, "metadata.json")
+        await self.disk_submit(self.write_metadata_file, metadata_file, metadata)
+        return metadata_file
+    
+    def load_previous_metadata(self, video_dir, cid):
+        """读取上次抓取该视频时保存的元数据，不存在时返回None"""
+        if self.storage_format == "pack":
+            return self.previous_metadata.get(cid)
+        
+        metadata_file = os.path.join(video_dir, "metadata.json")
+        if not os.path.exists(metadata_file):
+            return None
+        try:
+            with open(metadata_file, 'r', encoding='utf-8') as f:
+                previous = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return previous if previous.get('cid') == cid else None
+    
+    def should_refresh_segment(self, previous_metadata, segment_index, video_info, is_tail):
+        """增量模式下判断分段是否需要重新获取"""
+        previous_segment = previous_metadata['segments'].get(str(segment_index))
+        if not previous_segment:
+            return True  # 上次未获取到的分段
+        
+        # 旧版元数据没有逐段的抓取时间，使用视频级的抓取时间
+        fetch_time = previous_segment.get('fetch_time') or previous_metadata.get('fetch_time')
+        try:
+            age = (datetime.datetime.now() - datetime.datetime.strptime(fetch_time, FETCH_TIME_FORMAT)).total_seconds()
+        except (TypeError, ValueError):
+            return True
+        
+        if age < self.refresh_ttl:
+            return False
+        if age >= self.stale_ttl:
+            return True
+        
+        # 新发布的视频弹幕仍在快速增长，所有分段都刷新；较早的视频只刷新末尾分段
+        pubdate = video_info.get('cid_info', {}).get('pubdate')
+        if pubdate and time.time() - pubdate < self.recent_video_days * 86400:
+            return True
+        return is_tail
+    
+    def get_video_dir(self, aid, part_number=1):
+        """视频(分P)的保存目录，第2P起保存在 {aid}/p{分P序号} 子目录"""
+        video_dir = os.path.join(self.danmaku_dir, f"{aid}")
+        if part_number > 1:
+            video_dir = os.path.join(video_dir, f"p{part_number}")
+        return video_dir
+    
+    async def save_raw_danmaku(self, session, video_info, rate_limiter, max_segments=100, pbar=None):
+        """保存指定视频(分P)的所有分段弹幕数据"""
+        cid = video_info.get('cid') or video_info.get('cid_info', {}).get('main_cid')
         title = video_info.get('title', '')
         aid = video_info.get('aid')
         bvid = video_info.get('bvid')
+        part_number = video_info.get('part_number', 1)
         
         if not cid:
-            print(f"视频信息缺少CID: {title}")
+            logger.warning("视频信息缺少CID: %s", title)
             if pbar:
                 pbar.update(1)
             return None
@@ -122,12 +503,13 @@ class DanmakuCrawler:
         safe_title = "".join([c if c.isalnum() or c in [' ', '_', '-'] else '_' for c in title])
         safe_title = safe_title[:50]  # 限制长度
         
-        # 创建视频专属目录
-        video_dir = os.path.join(self.danmaku_dir, f"{aid}")
-        if not os.path.exists(video_dir):
-            os.makedirs(video_dir)
+        # 创建视频专属目录 (打包存储时不需要)
+        video_dir = self.get_video_dir(aid, part_number)
+        if self.storage_format != "pack":
+            await self.disk_submit(functools.partial(os.makedirs, video_dir, exist_ok=True))
         
-        print(f"\n处理视频: {title} (CID: {cid})")
+        logger.debug("处理视频: %s%s (CID: %s)", title,
+                     f" P{part_number}" if video_info.get('part_count', 1) > 1 else "", cid)
         
         # 收集元数据
         metadata = {
@@ -135,151 +517,602 @@ class DanmakuCrawler:
             'aid': aid,
             'bvid': bvid,
             'cid': cid,
-            'fetch_time': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            'segments': {}
+            'part_number': part_number,
+            'part_name': video_info.get('part_name'),
+            'fetch_time': datetime.datetime.now().strftime(FETCH_TIME_FORMAT),
+            'segments': {},
+            'failed_segments': []
         }
         
+        # 增量模式: 读取上次的分段记录，跳过无需刷新的分段
+        previous_metadata = await self.disk_call(self.load_previous_metadata, video_dir, cid) if self.incremental else None
+        previous_segments = previous_metadata['segments'] if previous_metadata else {}
+        previous_count = max((int(index) for index in previous_segments), default=0)
+        
+        # 任务队列中记录的已完成分段(上次处理该视频时中断或部分失败)
+        done_segments = await self.disk_call(self.work_queue.done_segments, cid) if self.work_queue else {}
+        
+        def needs_fetch(segment_index, is_tail):
+            if segment_index in done_segments:
+                if done_segments[segment_index]:
+                    metadata['segments'][segment_index] = done_segments[segment_index]
+                return False
+            if not previous_metadata:
+                return True
+            if self.should_refresh_segment(previous_metadata, segment_index, video_info, is_tail):
+                return True
+            # 沿用上次的分段记录
+            metadata['segments'][segment_index] = previous_segments[str(segment_index)]
+            return False
+        
+        async def record_segment(segment_index, segment_data):
+            """保存获取到的分段并更新任务状态，返回分段是否有效"""
+            previous_segment = previous_segments.get(str(segment_index))
+            
+            if segment_data and len(segment_data) > 40:  # 确保响应内容有效
+                changed = await self.save_segment(video_dir, segment_index, segment_data, metadata, previous_segment)
+                if self.work_queue:
+                    # 写入线程按提交顺序执行，分段数据写入成功后才记录完成状态
+                    await self.disk_submit(
+                        self.finish_saved_segment, cid, segment_index, metadata['segments'][segment_index]
+                    )
+                self.metrics.inc('crawler_segments_total', result='saved' if changed else 'unchanged')
+                if logger.isEnabledFor(logging.DEBUG):
+                    log_event(logger, logging.DEBUG, 'segment', "  成功获取第 %d 段弹幕 (%d 字节%s)",
+                              segment_index, len(segment_data), "" if changed else "，内容未变化",
+                              cid=cid, segment=segment_index, bytes=len(segment_data), changed=changed)
+                return True
+            
+            if segment_data is None:
+                # 达到最大重试次数仍失败，留待下次重试
+                metadata['failed_segments'].append(segment_index)
+                if self.work_queue:
+                    await self.disk_submit(self.work_queue.finish_segment, cid, segment_index, False)
+            elif self.work_queue:
+                await self.disk_submit(self.work_queue.finish_segment, cid, segment_index, True)
+            self.metrics.inc('crawler_segments_total', result='failed' if segment_data is None else 'empty')
+            
+            if previous_segment:
+                # 刷新失败时保留上次的记录
+                metadata['segments'][segment_index] = previous_segment
+                logger.warning("  第 %d 段弹幕刷新失败，保留上次的数据 (CID: %s)", segment_index, cid)
+            elif segment_data is None:
+                logger.warning("  第 %d 段弹幕获取失败 (CID: %s)", segment_index, cid)
+            else:
+                # 逐段请求时的正常结束条件
+                logger.debug("  第 %d 段弹幕无效或为空 (CID: %s)", segment_index, cid)
+            return False
+        
         # 获取所有分段弹幕
         successfully_fetched = 0
+        skipped = 0
         
-        for segment_index in range(1, max_segments + 1):
-            segment_data = await self.get_segment_danmaku(
-                session, cid, segment_index, aid, proxy_url, rate_limiter
+        segment_count = None
+        if self.segment_fanout:
+            segment_count = await self.resolve_segment_count(
+                session, video_info, cid, aid, rate_limiter, max_segments
             )
+        
+        if segment_count:
+            # 分段数已知: 同时请求所有需要获取的分段，由共享的限速器控制整体速率
+            tail_start = segment_count - self.tail_segments + 1
+            fetch_indexes = [
+                segment_index for segment_index in range(1, segment_count + 1)
+                if needs_fetch(segment_index, segment_index >= tail_start)
+            ]
+            skipped = segment_count - len(fetch_indexes)
             
-            if segment_data and len(segment_data) > 40:  # 确保响应内容有效
-                # 保存到二进制文件
-                segment_file = os.path.join(video_dir, f"segment_{segment_index}.bin")
-                with open(segment_file, 'wb') as f:
-                    f.write(segment_data)
+            if self.work_queue:
+                await self.disk_submit(self.work_queue.start_segments, cid, fetch_indexes)
+            results = await asyncio.gather(*[
+                self.get_segment_danmaku(session, cid, segment_index, aid, rate_limiter)
+                for segment_index in fetch_indexes
+            ])
+            
+            for segment_index, segment_data in zip(fetch_indexes, results):
+                if await record_segment(segment_index, segment_data):
+                    successfully_fetched += 1
+        else:
+            # 分段数未知: 逐段请求，遇到无效分段即停止
+            for segment_index in range(1, max_segments + 1):
+                # 上次记录的分段之后可能还有新分段，最后几段总是视为末尾分段
+                if not needs_fetch(segment_index, segment_index > previous_count - self.tail_segments):
+                    if segment_index in done_segments and not done_segments[segment_index]:
+                        break  # 上次已确认视频在此结束
+                    skipped += 1
+                    continue
                 
-                # 记录元数据
-                segment_start_time = (segment_index - 1) * 6  # 每段6分钟
-                metadata['segments'][segment_index] = {
-                    'file': segment_file,
-                    'size': len(segment_data),
-                    'start_time': f"{segment_start_time}:00",
-                    'end_time': f"{segment_start_time + 6}:00"
-                }
+                if self.work_queue:
+                    await self.disk_submit(self.work_queue.start_segments, cid, [segment_index])
+                segment_data = await self.get_segment_danmaku(
+                    session, cid, segment_index, aid, rate_limiter
+                )
                 
-                successfully_fetched += 1
-                print(f"  成功获取第 {segment_index} 段弹幕 ({len(segment_data)} 字节)")
-            else:
-                print(f"  第 {segment_index} 段弹幕无效或视频不足这么长")
-                break
+                if await record_segment(segment_index, segment_data):
+                    successfully_fetched += 1
+                elif str(segment_index) not in previous_segments:
+                    break  # 视频不足这么长，或获取失败无法判断后续分段
         
-        # 保存元数据到JSON
-        metadata_file = os.path.join(video_dir, "metadata.json")
-        with open(metadata_file, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, ensure_ascii=False, indent=2)
+        # 保存元数据
+        metadata_location = await self.save_metadata(video_dir, metadata)
+        if skipped:
+            self.metrics.inc('crawler_segments_total', skipped, result='skipped')
         
-        print(f"成功获取 {successfully_fetched} 个分段弹幕，元数据已保存至 {metadata_file}")
+        log_event(logger, logging.INFO, 'video', "%s: 成功获取 %d 个分段弹幕%s，元数据已保存至 %s",
+                  title, successfully_fetched, f"，增量模式跳过 {skipped} 个" if skipped else "", metadata_location,
+                  cid=cid, aid=aid, part=part_number, fetched=successfully_fetched, skipped=skipped,
+                  failed=len(metadata['failed_segments']))
         if pbar:
             pbar.update(1)
         return metadata
     
-    async def process_video_batch(self, videos, session, rate_limiter, proxy_url, pbar):
-        """处理一批视频的异步任务"""
-        tasks = []
-        for video_info in videos:
-            task = asyncio.create_task(
-                self.save_raw_danmaku(session, video_info, rate_limiter, proxy_url, pbar=pbar)
-            )
-            tasks.append(task)
+    async def video_worker(self, queue, session, rate_limiter, pbar, stats):
+        """常驻工作协程: 从队列中持续取出视频处理，完成一个立即取下一个"""
+        while True:
+            _, _, item = await queue.get()
+            try:
+                if item is None:
+                    return
+                
+                cid, video_info = item
+                error = None
+                try:
+                    result = await self.save_raw_danmaku(session, video_info, rate_limiter, pbar=pbar)
+                    if result is None:
+                        error = "视频信息缺少CID"
+                    elif result['failed_segments']:
+                        error = f"分段获取失败: {result['failed_segments']}"
+                except Exception as e:
+                    log_event(logger, logging.ERROR, 'video_error', "处理视频时发生异常: %s (CID: %s)", str(e)[:100], cid,
+                              cid=cid, error=str(e)[:200])
+                    error = str(e)[:200]
+                    if pbar:
+                        pbar.update(1)
+                
+                # 写入线程按提交顺序执行，此时该视频之前提交的写入都已完成
+                write_failures = await self.disk_call(self.take_write_failures, cid)
+                if write_failures:
+                    log_event(logger, logging.ERROR, 'write_error', "分段写入磁盘失败: %s (CID: %s)", write_failures, cid,
+                              cid=cid, segments=write_failures)
+                    error = error or f"分段写入失败: {write_failures}"
+                
+                # 每完成一个视频就在任务队列中记录其状态
+                await self.disk_submit(self.work_queue.finish_video, cid, error is None, error)
+                self.metrics.record_video(error is None)
+                stats['finished'] += 1
+                if error is None:
+                    stats['success'] += 1
+                
+                if stats['finished'] % self.concurrent_requests == 0:
+                    logger.info("已处理: %d/%d 视频，成功: %d", stats['finished'], stats['total'], stats['success'])
+            finally:
+                queue.task_done()
+    
+    async def write_metrics_periodically(self, path):
+        """每隔 metrics_interval 秒将指标快照写入文件"""
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            await self.disk_submit(self.metrics.write_snapshot, path, self.metrics.snapshot())
+    
+    async def renew_leases_periodically(self):
+        """定期续租本进程领取的视频任务，避免等待中(本地队列、熔断暂停)的任务被其他进程当作过期任务重新领取"""
+        while True:
+            await asyncio.sleep(self.work_queue.lease_timeout / 3)
+            await self.disk_submit(self.work_queue.renew_leases)
+    
+    def expand_video_parts(self, video_info):
+        """将视频展开为每个分P一个任务，各分P独立调度、独立保存"""
+        cid_info = video_info.get('cid_info', {})
+        parts = cid_info.get('parts') or []
+        if not parts:
+            return [dict(video_info, cid=cid_info.get('main_cid'), part_number=1, part_count=1,
+                         duration=cid_info.get('duration'))]
         
-        # 等待所有任务完成
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        return [
+            dict(video_info, cid=part['cid'], part_number=part['part_number'], part_name=part.get('part_name'),
+                 part_count=len(parts), duration=part.get('duration'))
+            for part in parts
+        ]
+    
+    def find_saved_cids(self, jobs):
+        """返回已完整保存在磁盘上(元数据存在且没有失败分段)的分P的cid"""
+        if self.storage_format == "pack":
+            pack_reader = SegmentPackReader(self.pack_dir)
+            saved = {
+                metadata['cid'] for metadata in pack_reader.iter_metadata()
+                if not metadata.get('failed_segments')
+            }
+            pack_reader.close()
+            return saved
         
-        # 处理结果，计算成功数
-        success_count = sum(1 for r in results if r is not None and not isinstance(r, Exception))
-        return success_count
+        saved = set()
+        for job in jobs:
+            metadata_file = os.path.join(self.get_video_dir(job.get('aid'), job.get('part_number', 1)), "metadata.json")
+            if not os.path.exists(metadata_file):
+                continue
+            try:
+                with open(metadata_file, 'r', encoding='utf-8') as f:
+                    metadata = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if metadata.get('cid') == job['cid'] and not metadata.get('failed_segments'):
+                saved.add(job['cid'])
+        return saved
     
-    async def process_cid_mapping_async(self):
-        """异步处理CID映射文件中的所有视频"""
-        if not os.path.exists(self.cid_mapping_file):
-            print(f"错误: CID映射文件不存在: {self.cid_mapping_file}")
-            return
+    def dedupe_jobs(self, jobs):
+        """
+        在发出任何请求之前去除重复任务: 同一视频可能以不同的arcurl出现在多个关键词和分类的搜索结果中，
+        按cid只保留一个；非增量模式下还会跳过已完整保存在磁盘上的分P
+
+        返回: (去重后的任务列表, 重复的任务数, 已保存而跳过的任务数)
+        """
+        unique_jobs = {}
+        for job in jobs:
+            if job.get('cid') and job['cid'] not in unique_jobs:
+                unique_jobs[job['cid']] = job
+        duplicates = len(jobs) - len(unique_jobs)
+        
+        if self.incremental:
+            return list(unique_jobs.values()), duplicates, 0
+        
+        saved = self.find_saved_cids(unique_jobs.values())
+        return [job for cid, job in unique_jobs.items() if cid not in saved], duplicates, len(saved)
+    
+    def job_priority(self, video_info, finished_times, now):
+        """按 priority_weights 计算任务的优先级"""
+        priority = 0.0
+        for key, weight in self.priority_weights.items():
+            if key == 'video_review':
+                value = math.log10(1 + max(0, int(video_info.get('video_review') or 0)))
+            elif key == 'recency':
+                pubdate = video_info.get('pubdate') or video_info.get('cid_info', {}).get('pubdate')
+                value = 1 / (1 + max(0.0, now - pubdate) / 86400 / 30) if pubdate else 0.0
+            elif key == 'staleness':
+                last_fetch = finished_times.get(video_info.get('cid'))
+                hours = (now - last_fetch) / 3600 if last_fetch else 24 * 365
+                value = math.log10(1 + max(0.0, hours))
+            else:
+                raise ValueError(f"未知的优先级指标: {key}")
+            priority += weight * value
+        return priority
+    
+    def prepare_work_queue(self, enqueue=True):
+        """打开任务队列，加入CID映射中的视频，并恢复中断或失败的任务"""
+        work_queue = CrawlQueue(self.queue_file, self.worker_id)
+        released = work_queue.release_stale()
+        if not enqueue:
+            # 多进程爬取时由启动器统一加入任务，各进程只恢复自己中断的任务
+            return work_queue
         
-        # 加载CID映射
         with open(self.cid_mapping_file, 'r', encoding='utf-8') as f:
             video_mapping = json.load(f)
         
-        videos_to_process = list(video_mapping.values())
-        total_videos = len(videos_to_process)
+        jobs = [job for video_info in video_mapping.values() for job in self.expand_video_parts(video_info)]
+        unique_jobs, duplicates, saved = self.dedupe_jobs(jobs)
+        finished_times = work_queue.finished_times() if 'staleness' in self.priority_weights else {}
+        now = time.time()
+        added = work_queue.enqueue_videos(
+            unique_jobs, lambda video_info: self.job_priority(video_info, finished_times, now)
+        )
+        retried = work_queue.retry_failed(self.max_video_attempts)
+        reopened = work_queue.reopen_done() if self.incremental else 0
         
-        # 从指定的索引开始处理
-        if self.start_index >= total_videos:
-            print(f"错误: 起始索引 {self.start_index} 超出视频总数 {total_videos}")
+        print(f"加载了 {len(video_mapping)} 个视频({len(jobs)} 个分P)的CID映射，去除重复 {duplicates} 个，"
+              f"跳过已保存 {saved} 个，新增 {added} 个任务，恢复中断任务 {released} 个，重试失败任务 {retried} 个"
+              + (f"，增量重爬 {reopened} 个" if reopened else ""))
+        return work_queue
+    
+    async def process_cid_mapping_async(self, rate_limiter=None, prepare_queue=True):
+        """
+        异步处理CID映射文件中的所有视频
+        
+        多进程爬取时由启动器传入跨进程共享的限速器，并由启动器统一准备任务队列
+        """
+        if not os.path.exists(self.cid_mapping_file):
+            print(f"错误: CID映射文件不存在: {self.cid_mapping_file}")
+            return
+        
+        # 持久化任务队列取代单一的断点索引，重启后精确恢复，只重试失败的任务
+        self.work_queue = self.prepare_work_queue(enqueue=prepare_queue)
+        pending_count = self.work_queue.counts(self.shard_index, self.shard_count)[PENDING]
+        if pending_count == 0:
+            print("没有待处理的视频")
+            self.work_queue.close()
+            self.work_queue = None
             return
         
-        videos_to_process = videos_to_process[self.start_index:]
-        videos_to_process_count = len(videos_to_process)
+        # 在打开会话、启动后台任务之前创建输出写入器，配置错误(如不支持的列式格式、缺少pyarrow)时直接退出
+        try:
+            if self.storage_format == "pack":
+                if self.incremental:
+                    pack_reader = SegmentPackReader(self.pack_dir)
+                    self.previous_metadata = {metadata['cid']: metadata for metadata in pack_reader.iter_metadata()}
+                    pack_reader.close()
+                self.pack_writer = SegmentPackWriter(self.pack_dir, self.pack_writer_id, self.pack_shard_size)
+            
+            if self.columnar_output:
+                self.columnar_sink = ColumnarDanmakuSink(self.columnar_dir, self.columnar_format, self.pack_writer_id)
+        except Exception:
+            if self.pack_writer:
+                self.pack_writer.close()
+                self.pack_writer = None
+            self.work_queue.close()
+            self.work_queue = None
+            raise
         
-        print(f"加载了 {total_videos} 个视频的CID映射，将从第 {self.start_index} 条开始处理，共 {videos_to_process_count} 个视频")
+        print(f"共 {pending_count} 个视频待处理")
         
-        # 创建会话和令牌桶限流器
-        session, proxy_url = await self.create_session()
-        rate_limiter = RateLimiter(self.concurrent_requests)  # 控制整体速率
+        setup_logging(
+            self.log_level, self.console_log_rate,
+            self.event_log_file.format(worker_id=self.worker_id) if self.event_log else None
+        )
+        
+        # 创建会话池和令牌桶限流器
+        session = await self.create_session()
+        proxy_configs = self.proxy_configs or ([self.proxy_config] if self.proxy_config else [])
+        self.proxy_pool = ProxyPool(proxy_configs, self.max_requests_per_proxy)
+        health_check_task = asyncio.create_task(self.proxy_pool.run_health_checks(session))
+        if rate_limiter is None:
+            rate_limiter = RateLimiter(self.concurrent_requests, self.rate_burst)  # 控制整体速率
+        if self.adaptive_rate:
+            self.rate_controller = AdaptiveRateController(rate_limiter, self.min_rate, self.max_rate)
+        
+        # 磁盘写入和任务队列更新交给专用写入线程，不阻塞事件循环
+        self.disk_writer = DiskWriter(self.writer_queue_size)
+        if self.pack_writer:
+            self.disk_writer.add_batch_callback(functools.partial(self.pack_writer.flush, self.fsync_writes))
+        self.disk_writer.start()
         
         # 创建进度条
-        pbar = tqdm(total=videos_to_process_count, desc="处理视频")
+        pbar = tqdm(total=pending_count, desc=f"处理视频 [{self.worker_id}]", position=self.shard_index)
+        stats = {'total': pending_count, 'finished': 0, 'success': 0}
         
-        try:
-            # 将视频分成小批次处理
-            batch_size = self.concurrent_requests
-            total_success = 0
+        # 有界优先队列(堆) + 固定数量的常驻工作协程，某个视频完成后立即补充优先级最高的下一个
+        worker_count = self.concurrent_requests
+        queue = asyncio.PriorityQueue(maxsize=worker_count * 2)
+        sequence = itertools.count()  # 优先级相同时按领取顺序
+        workers = [
+            asyncio.create_task(self.video_worker(queue, session, rate_limiter, pbar, stats))
+            for _ in range(worker_count)
+        ]
+        
+        # 监控指标: 队列深度和限速器状态在读取时计算
+        self.metrics.add_gauge('crawler_video_queue_depth', queue.qsize, "等待处理的已领取视频数")
+        self.metrics.add_gauge('crawler_disk_queue_depth', lambda: self.disk_writer.pending, "等待执行的磁盘操作数")
+        self.metrics.add_gauge('crawler_disk_errors', lambda: self.disk_writer.error_count, "磁盘写入失败次数")
+        self.metrics.add_gauge('crawler_rate_limit', lambda: rate_limiter.rate_limit, "当前每秒请求数上限")
+        self.metrics.add_gauge('crawler_rate_limiter_waiting', lambda: rate_limiter.wait_stats()['waiting'],
+                               "正在等待令牌的请求数")
+        self.metrics.add_gauge('crawler_proxies_available', lambda: self.proxy_pool.available_count, "未被隔离的代理数")
+        if self.circuit_breaker:
+            self.metrics.add_gauge('crawler_circuit_open', lambda: self.circuit_breaker.state != CircuitBreaker.CLOSED,
+                                   "熔断器是否处于打开或半开状态")
+            self.metrics.add_gauge('crawler_circuit_open_total', lambda: self.circuit_breaker.open_count, "熔断次数")
+        metrics_server = None
+        if self.metrics_port:
+            metrics_server = MetricsServer(self.metrics, port=self.metrics_port + self.shard_index)
+            await metrics_server.start()
+            logger.info("监控指标: http://127.0.0.1:%d/metrics", metrics_server.port)
+        metrics_file = self.metrics_file.format(worker_id=self.worker_id) if self.metrics_file else None
+        metrics_task = asyncio.create_task(self.write_metrics_periodically(metrics_file)) if metrics_file else None
+        lease_task = asyncio.create_task(self.renew_leases_periodically())
+        
+        async def feed_queue():
+            # 按优先级从持久化队列中领取任务，每次补满队列的空位，多个进程可以同时从同一队列领取
+            while True:
+                claimed = await self.disk_call(
+                    self.work_queue.claim_videos, max(1, queue.maxsize - queue.qsize()),
+                    self.shard_index, self.shard_count
+                )
+                if not claimed:
+                    break
+                for cid, priority, video_info in claimed:
+                    await queue.put((-priority, next(sequence), (cid, video_info)))
             
-            for i in range(0, videos_to_process_count, batch_size):
-                batch = videos_to_process[i:i+batch_size]
-                success_count = await self.process_video_batch(batch, session, rate_limiter, proxy_url, pbar)
-                total_success += success_count
-                
-                # 每处理一批次，报告进度
-                current_progress = min(i+batch_size, videos_to_process_count)
-                print(f"\n已处理: {current_progress}/{videos_to_process_count} 视频 (全局索引: {self.start_index + current_progress}/{total_videos})，成功: {total_success}")
-                
-                # 保存进度到文件，以便中断后可以继续
-                progress_file = os.path.join(self.base_dir, "crawler_progress.json")
-                with open(progress_file, 'w', encoding='utf-8') as f:
-                    json.dump({
-                        'last_processed_index': self.start_index + current_progress - 1,
-                        'total_videos': total_videos,
-                        'success_count': total_success,
-                        'timestamp': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    }, f, ensure_ascii=False, indent=2)
+            # 每个工作协程收到一个结束标记后退出，结束标记排在所有任务之后
+            for _ in range(worker_count):
+                await queue.put((math.inf, next(sequence), None))
+        
+        try:
+            # 任一工作协程异常退出时立即结束，避免投递任务时永久阻塞
+            await asyncio.gather(feed_queue(), *workers)
         
         finally:
-            # 确保会话被关闭
+            for worker in workers:
+                worker.cancel()
+            health_check_task.cancel()
+            lease_task.cancel()
+            if metrics_task:
+                metrics_task.cancel()
+            if metrics_server:
+                await metrics_server.stop()
+            
+            # 确保会话池被关闭
             await session.close()
             pbar.close()
+            
+            # 等待已提交的写入全部完成后再关闭写入器和任务队列
+            await self.disk_writer.close()
+            self.disk_writer = None
+            if self.pack_writer:
+                self.pack_writer.close()
+                self.pack_writer = None
+            if self.columnar_sink:
+                self.columnar_sink.close()
+                self.columnar_sink = None
+            
+            counts = self.work_queue.counts(self.shard_index, self.shard_count)
+            self.work_queue.close()
+            self.work_queue = None
+            
+            if metrics_file:
+                self.metrics.write_snapshot(metrics_file)
+        
+        print(f"\n处理完成! 本次处理 {stats['finished']} 个视频，{stats['success']} 个成功")
+        print(f"任务队列: 已完成 {counts[DONE]} 个，失败 {counts[FAILED]} 个，待处理 {counts[PENDING]} 个")
         
-        print(f"\n处理完成! 总计处理 {videos_to_process_count} 个视频 (从第 {self.start_index} 条开始)，{total_success} 个成功")
+        wait_stats = rate_limiter.wait_stats()
+        print(f"限速器: 共发放 {wait_stats['acquire_count']} 个令牌，平均等待 {wait_stats['avg_wait_time']:.3f} 秒，最长等待 {wait_stats['max_wait_time']:.3f} 秒")
+        if self.rate_controller:
+            print(f"自适应限速: 最终速率 {rate_limiter.rate_limit:.2f} 次/秒，共降速 {self.rate_controller.decrease_count} 次")
+        for proxy_stats in self.proxy_pool.summary():
+            latency = f"{proxy_stats['latency']:.3f} 秒" if proxy_stats['latency'] is not None else "-"
+            print(f"代理 {proxy_stats['proxy']}: 请求 {proxy_stats['requests']} 次，失败 {proxy_stats['failures']} 次，"
+                  f"平均延迟 {latency}，被隔离 {proxy_stats['quarantine_count']} 次")
+        
+        log_event(logger, logging.DEBUG, 'run_summary', "本次爬取结束",
+                  finished=stats['finished'], success=stats['success'], queue=counts,
+                  rate_limit=rate_limiter.rate_limit, wait_stats=wait_stats, proxies=self.proxy_pool.summary())
+        close_logging()
+
+
+# 轮询分配请求的会话池
+class SessionPool:
+    def __init__(self, sessions):
+        self.sessions = sessions
+        self._next_session = itertools.cycle(sessions)
+    
+    def get(self, *args, **kwargs):
+        """按轮询顺序选择一个会话发起GET请求，用法与aiohttp.ClientSession.get相同"""
+        return next(self._next_session).get(*args, **kwargs)
+    
+    async def close(self):
+        """关闭所有会话及其连接"""
+        await asyncio.gather(*(session.close() for session in self.sessions))
 
 
 # 限制请求频率的令牌桶
 class RateLimiter:
-    def __init__(self, rate_limit=5):
-        self.rate_limit = rate_limit      # 每秒请求数
-        self.tokens = rate_limit          # 当前可用令牌数
-        self.last_check = time.time()     # 上次更新令牌的时间
-        self.lock = asyncio.Lock()        # 异步锁，用于令牌更新
+    def __init__(self, rate_limit=5, burst=None):
+        self.rate_limit = rate_limit              # 每秒请求数
+        self.burst = burst or rate_limit          # 令牌桶容量，即允许的最大突发请求数
+        self.tokens = self.burst                  # 当前可用令牌数
+        self.last_check = time.monotonic()        # 上次更新令牌的时间
+        self._waiters = collections.deque()       # 按到达顺序排队的等待者
+        self._wakeup_handle = None                # 下一个令牌可用时的唤醒定时器
+        self.last_rate_decrease = float('-inf')   # 上次降低速率的时间
+        
+        # 等待时间统计，用于判断瓶颈在限速器还是网络
+        self.acquire_count = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+    
+    def _refill(self):
+        """根据经过的时间恢复令牌"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last_check) * self.rate_limit)
+        self.last_check = now
+    
+    def _wake_waiters(self):
+        """按先进先出顺序把可用令牌分配给等待者，并在下一个令牌可用时再次唤醒"""
+        if self._wakeup_handle:
+            self._wakeup_handle.cancel()
+            self._wakeup_handle = None
+        
+        self._refill()
+        while self._waiters and self.tokens >= 1:
+            waiter = self._waiters.popleft()
+            if waiter.done():  # 等待者已被取消
+                continue
+            self.tokens -= 1
+            waiter.set_result(None)
+        
+        if self._waiters:
+            # 精确计算下一个令牌可用的时间，而不是轮询
+            delay = (1 - self.tokens) / self.rate_limit
+            self._wakeup_handle = asyncio.get_running_loop().call_later(delay, self._wake_waiters)
     
     async def acquire(self):
-        """获取一个令牌，如果没有令牌则等待"""
-        while True:
-            async with self.lock:
-                now = time.time()
-                # 计算经过的时间，恢复令牌
-                time_passed = now - self.last_check
-                self.tokens = min(self.rate_limit, self.tokens + time_passed * self.rate_limit)
-                self.last_check = now
-                
-                if self.tokens >= 1:
-                    self.tokens -= 1
-                    return True
-            
-            # 如果没有足够令牌，等待一小段时间再试
-            await asyncio.sleep(0.05)
+        """获取一个令牌，如果没有令牌则排队等待，返回本次等待的秒数"""
+        start = time.monotonic()
+        self._refill()
+        
+        # 没有排队者且有令牌时直接通过，保证先到先得
+        if not self._waiters and self.tokens >= 1:
+            self.tokens -= 1
+            self._record_wait(0.0)
+            return 0.0
+        
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        if len(self._waiters) == 1:
+            self._wake_waiters()
+        
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # 令牌已分配但调用方被取消，归还令牌
+                self.tokens += 1
+            if self._waiters:
+                self._wake_waiters()
+            raise
+        
+        waited = time.monotonic() - start
+        self._record_wait(waited)
+        return waited
+    
+    def set_rate(self, rate_limit):
+        """调整每秒请求数，已排队的等待者按新速率重新计算唤醒时间"""
+        self._refill()  # 先按旧速率结算已经恢复的令牌
+        if rate_limit < self.rate_limit:
+            self.last_rate_decrease = time.monotonic()
+        self.rate_limit = rate_limit
+        if self._waiters:
+            self._wake_waiters()
+    
+    def _record_wait(self, waited):
+        self.acquire_count += 1
+        self.total_wait_time += waited
+        self.max_wait_time = max(self.max_wait_time, waited)
+    
+    def wait_stats(self):
+        """返回获取令牌的等待时间统计"""
+        return {
+            'acquire_count': self.acquire_count,
+            'waiting': len(self._waiters),
+            'total_wait_time': self.total_wait_time,
+            'avg_wait_time': self.total_wait_time / self.acquire_count if self.acquire_count else 0.0,
+            'max_wait_time': self.max_wait_time
+        }
+
+
+# 加性增、乘性减(AIMD)的自适应速率控制器
+class AdaptiveRateController:
+    THROTTLE_STATUSES = (412, 429)  # 反爬拦截或请求过于频繁
+    
+    def __init__(self, rate_limiter, min_rate=1, max_rate=20, increase_step=0.5, decrease_factor=0.5, cooldown=2.0):
+        self.rate_limiter = rate_limiter
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase_step = increase_step      # 每秒成功请求量对应的速率增量
+        self.decrease_factor = decrease_factor  # 被限流时的速率缩减比例
+        self.cooldown = cooldown                # 两次降速之间的最短间隔(秒)
+        self.decrease_count = 0
+    
+    def record_response(self, status):
+        """根据HTTP状态码调整速率"""
+        if status == 200:
+            self.record_success()
+        elif status in self.THROTTLE_STATUSES or status >= 500:
+            self.record_throttle()
+    
+    def record_success(self):
+        """成功响应: 每完成约一秒的请求量，速率增加increase_step"""
+        rate = self.rate_limiter.rate_limit
+        if rate < self.max_rate:
+            self.rate_limiter.set_rate(min(self.max_rate, rate + self.increase_step / rate))
+    
+    def record_throttle(self):
+        """被限流、服务器错误或超时: 速率按比例降低"""
+        # 同一时刻在途的请求会集中返回错误，冷却期内只降速一次
+        # 降速时间记录在限速器上，多个进程共享限速器时也只降速一次
+        if time.monotonic() - self.rate_limiter.last_rate_decrease < self.cooldown:
+            return
+        
+        rate = self.rate_limiter.rate_limit
+        self.rate_limiter.set_rate(max(self.min_rate, rate * self.decrease_factor))
+        self.decrease_count += 1
 
 
 async def main_async():
@@ -287,7 +1120,7 @@ async def main_async():
     crawler = DanmakuCrawler()
     print("B站视频弹幕异步爬取工具")
     print("=" * 40)
-    print(f"本工具将从CID映射文件中读取视频信息，从第 {crawler.start_index} 条开始，并使用异步方式获取每个视频的实时弹幕")
+    print("本工具将从CID映射文件中读取视频信息，加入持久化任务队列，并使用异步方式获取每个视频的实时弹幕")
     
     # 确认CID映射文件存在
     if not os.path.exists(crawler.cid_mapping_file):
@@ -295,8 +1128,8 @@ async def main_async():
         return
     
     # 确认代理信息已填写
-    if (crawler.proxy_config["user"] == "your-username" or 
-        crawler.proxy_config["pass"] == "your-password"):
+    if not crawler.proxy_configs and crawler.proxy_config and (crawler.proxy_config["user"] == "your-username" or 
+                                                               crawler.proxy_config["pass"] == "your-password"):
         print("警告: 未配置代理信息，请在代码中正确设置代理隧道的用户名和密码")
     
     await crawler.process_cid_mapping_async()
@@ -1,16 +1,22 @@
 # danmaku_extractor.py
 import os
 import json
+import numpy as np
 import pandas as pd
-import dm_pb2 as Danmaku
 from tqdm import tqdm
 from danmaku_parser import DanmakuParser
+from segment_pack import SegmentPackReader
+
+# 提取时需要解码的弹幕字段，其余字段(id、action、animation等)在解码时直接跳过
+EXTRACT_FIELDS = ('progress', 'content', 'mode', 'fontsize', 'color', 'ctime', 'weight', 'pool', 'midHash')
 
 class DanmakuExtractor:
-    def __init__(self, base_dir="./data"):
-        """初始化弹幕提取器"""
+    def __init__(self, base_dir="./data", workers=None):
+        """初始化弹幕提取器，workers 为解析进程数(默认为CPU核数)"""
         self.base_dir = base_dir
+        self.workers = workers
         self.danmaku_dir = os.path.join(base_dir, "弹幕数据")
+        self.pack_dir = os.path.join(base_dir, "弹幕分片")
         self.output_dir = os.path.join(base_dir, "处理后的弹幕")
         
         # 确保输出目录存在
@@ -18,86 +24,156 @@ class DanmakuExtractor:
     
     def parse_single_danmaku_file(self, bin_file_path):
         """解析单个弹幕文件为DataFrame格式"""
-        try:
-            # 使用DanmakuParser解析二进制文件
-            danmaku_seg = DanmakuParser.parse_danmaku_bin(bin_file_path)
-            
-            if not danmaku_seg:
-                return None
-            
-            # 提取弹幕信息
-            danmaku_list = []
-            for elem in danmaku_seg.elems:
-                danmaku_info = {
-                    'progress': elem.progress / 1000.0,  # 转换为秒
-                    'content': elem.content,
-                    'mode': elem.mode,
-                    'font_size': elem.fontsize,
-                    'color': elem.color,
-                    'timestamp': elem.ctime,
-                    'weight': elem.weight,
-                    'pool': elem.pool,
-                    'mid_hash': elem.midHash
-                }
-                danmaku_list.append(danmaku_info)
-            
-            return pd.DataFrame(danmaku_list)
-        except Exception as e:
-            print(f"解析文件失败 {bin_file_path}: {str(e)}")
+        # 在当前进程中解码为按列的数组，解码方式按protobuf实现选择，出错时由 parse_many 打印错误
+        batch, = DanmakuParser.parse_many([bin_file_path], workers=1, fields=EXTRACT_FIELDS)
+        if batch.errors:
             return None
+        return self.danmaku_columns_to_dataframe(batch)
     
-    def process_video_folder(self, video_folder):
-        """处理单个视频文件夹的所有弹幕数据"""
-        # 读取元数据
-        metadata_path = os.path.join(video_folder, "metadata.json")
-        if not os.path.exists(metadata_path):
+    def danmaku_columns_to_dataframe(self, columns):
+        """将按列的弹幕数据(DanmakuBatch)转换为DataFrame格式，列与 danmaku_seg_to_dataframe 一致"""
+        if not len(columns):
+            return None
+        
+        # 数值列直接从array.array的缓冲区构造，不逐条转换
+        def numeric(name):
+            column = columns[name]
+            return np.frombuffer(column, dtype=column.typecode).astype(np.int64)
+        
+        return pd.DataFrame({
+            'progress': numeric('progress') / 1000.0,  # 转换为秒
+            'content': columns.strings('content'),
+            'mode': numeric('mode'),
+            'font_size': numeric('fontsize'),
+            'color': numeric('color'),
+            'timestamp': numeric('ctime'),
+            'weight': numeric('weight'),
+            'pool': numeric('pool'),
+            'mid_hash': columns.strings('midHash')
+        })
+    
+    def danmaku_seg_to_dataframe(self, danmaku_seg):
+        """将解析后的弹幕分段转换为DataFrame格式"""
+        if not danmaku_seg:
             return None
         
-        with open(metadata_path, 'r', encoding='utf-8') as f:
-            metadata = json.load(f)
+        # 提取弹幕信息
+        danmaku_list = []
+        for elem in danmaku_seg.elems:
+            danmaku_info = {
+                'progress': elem.progress / 1000.0,  # 转换为秒
+                'content': elem.content,
+                'mode': elem.mode,
+                'font_size': elem.fontsize,
+                'color': elem.color,
+                'timestamp': elem.ctime,
+                'weight': elem.weight,
+                'pool': elem.pool,
+                'mid_hash': elem.midHash
+            }
+            danmaku_list.append(danmaku_info)
         
-        # 合并所有分段的弹幕数据
-        all_segments_df = []
+        return pd.DataFrame(danmaku_list)
+    
+    def collect_folder_segments(self, video_folder):
+        """列出视频文件夹中的所有分段文件(包括 p2、p3... 分P子文件夹)，返回 [(文件路径, 视频信息)]"""
+        # 读取元数据；各分P独立爬取，P1没有元数据(失败或尚未完成)时仍然处理其余分P
+        metadata = None
+        metadata_path = os.path.join(video_folder, "metadata.json")
+        if os.path.exists(metadata_path):
+            with open(metadata_path, 'r', encoding='utf-8') as f:
+                metadata = json.load(f)
+        
+        segments = []
         for segment_file in sorted(os.listdir(video_folder)):
-            if segment_file.startswith("segment_") and segment_file.endswith(".bin"):
-                df = self.parse_single_danmaku_file(os.path.join(video_folder, segment_file))
-                if df is not None:
-                    # 添加视频信息
-                    df['video_id'] = metadata['aid']
-                    df['video_title'] = metadata['title']
-                    df['cid'] = metadata['cid']
-                    df['segment'] = int(segment_file.split('_')[1].split('.')[0])
-                    all_segments_df.append(df)
+            if metadata is not None and segment_file.startswith("segment_") and segment_file.endswith(".bin"):
+                segments.append((os.path.join(video_folder, segment_file), {
+                    'video_id': metadata['aid'],
+                    'video_title': metadata['title'],
+                    'cid': metadata['cid'],
+                    'part': metadata.get('part_number', 1),
+                    'segment': int(segment_file.split('_')[1].split('.')[0])
+                }))
+            elif segment_file.startswith("p") and segment_file[1:].isdigit():
+                # 多P视频的其余分P
+                segments.extend(self.collect_folder_segments(os.path.join(video_folder, segment_file)))
+        return segments
+    
+    def collect_packed_segments(self, pack_reader, metadata):
+        """列出打包存储中单个视频的所有分段，返回 [((分片路径, 偏移, 长度), 视频信息)]"""
+        cid = metadata['cid']
+        return [
+            (pack_reader.locate(cid, segment_index), {
+                'video_id': metadata['aid'],
+                'video_title': metadata['title'],
+                'cid': cid,
+                'part': metadata.get('part_number', 1),
+                'segment': segment_index
+            })
+            for segment_index in pack_reader.segments(cid)
+        ]
+    
+    def segments_to_dataframe(self, segments, workers=1, show_progress=False):
+        """用 DanmakuParser.parse_many 解码分段并附加视频信息，弹幕按输入分段的顺序排列"""
+        if not segments:
+            return None
         
-        if all_segments_df:
-            return pd.concat(all_segments_df, ignore_index=True)
-        return None
+        batches = DanmakuParser.parse_many([source for source, _ in segments], workers, EXTRACT_FIELDS, show_progress)
+        video_info = pd.DataFrame([info for _, info in segments])
+        
+        all_batches_df = []
+        for batch in batches:
+            df = self.danmaku_columns_to_dataframe(batch)
+            if df is not None:
+                # 添加视频信息
+                file_index = np.frombuffer(batch.file_index, dtype=batch.file_index.typecode)
+                df = pd.concat([df, video_info.iloc[file_index].reset_index(drop=True)], axis=1)
+                df['_file_index'] = file_index
+                all_batches_df.append(df)
+        
+        if not all_batches_df:
+            return None
+        df = pd.concat(all_batches_df, ignore_index=True)
+        df = df.sort_values('_file_index', kind='stable', ignore_index=True)
+        return df.drop(columns='_file_index')
+    
+    def process_video_folder(self, video_folder):
+        """处理单个视频文件夹的所有弹幕数据(包括 p2、p3... 分P子文件夹)"""
+        return self.segments_to_dataframe(self.collect_folder_segments(video_folder))
+    
+    def process_packed_video(self, pack_reader, metadata):
+        """处理打包存储中单个视频的所有弹幕数据"""
+        return self.segments_to_dataframe(self.collect_packed_segments(pack_reader, metadata))
     
     def process_all_videos(self):
         """处理所有视频的弹幕数据"""
         # 获取所有视频文件夹
-        video_folders = [f for f in os.listdir(self.danmaku_dir) 
-                        if os.path.isdir(os.path.join(self.danmaku_dir, f))]
+        video_folders = []
+        if os.path.isdir(self.danmaku_dir):
+            video_folders = [f for f in os.listdir(self.danmaku_dir) 
+                            if os.path.isdir(os.path.join(self.danmaku_dir, f))]
         
-        print(f"开始处理 {len(video_folders)} 个视频的弹幕数据...")
+        # 获取打包存储中的所有分P(每个cid一条元数据)
+        pack_reader = SegmentPackReader(self.pack_dir)
+        packed_parts = list(pack_reader.iter_metadata())
         
-        # 创建一个空的DataFrame列表，用于存储所有视频的弹幕数据
-        all_danmaku_dfs = []
+        # 文件夹按视频(aid)组织，打包存储按分P记录，统一按不同的aid计数
+        video_count = len(set(video_folders) | {str(metadata['aid']) for metadata in packed_parts})
+        print(f"开始处理 {video_count} 个视频的弹幕数据...")
+        print(DanmakuParser.backend_message())
         
-        # 处理每个视频文件夹
-        for folder in tqdm(video_folders, desc="处理视频文件夹"):
-            video_path = os.path.join(self.danmaku_dir, folder)
-            df = self.process_video_folder(video_path)
-            
-            if df is not None:
-                all_danmaku_dfs.append(df)
+        # 先列出所有分段，再用进程池按数据大小均衡地分批解码
+        segments = []
+        for folder in tqdm(video_folders, desc="列出视频文件夹"):
+            segments.extend(self.collect_folder_segments(os.path.join(self.danmaku_dir, folder)))
+        for metadata in packed_parts:
+            segments.extend(self.collect_packed_segments(pack_reader, metadata))
+        pack_reader.close()
         
-        # 合并所有DataFrame
-        if all_danmaku_dfs:
-            print("合并所有弹幕数据...")
-            final_df = pd.concat(all_danmaku_dfs, ignore_index=True)
-            
-            print(f"总计处理了 {len(video_folders)} 个视频，{len(final_df)} 条弹幕")
+        final_df = self.segments_to_dataframe(segments, self.workers, show_progress=True)
+        
+        if final_df is not None:
+            print(f"总计处理了 {video_count} 个视频，{len(final_df)} 条弹幕")
             
             # 保存一份CSV格式
             csv_file = os.path.join(self.output_dir, "all_danmaku.csv")
@@ -119,8 +195,9 @@ class DanmakuExtractor:
 def main():
     # 设置基础目录，根据实际情况修改
     base_dir = "./data"
+    workers = os.cpu_count()  # 解析进程数
     
-    extractor = DanmakuExtractor(base_dir)
+    extractor = DanmakuExtractor(base_dir, workers)
     extractor.process_all_videos()
 
 
@@ -1,22 +1,158 @@
 # danmaku_parser.py
 import sys
 import os
-from google.protobuf import text_format
+import mmap
+import heapq
+import contextlib
+import concurrent.futures
+from tqdm import tqdm
+from crawler_log import get_logger
+from danmaku_fast_decoder import DEFAULT_FIELDS, DanmakuBatchBuilder, decode_segment
+
+logger = get_logger("parser")
+
+# 不小于此大小的文件才使用内存映射读取；更小的文件建立映射和缺页的开销超过一次read的复制
+MMAP_MIN_SIZE = 1 << 20
+
+_schema = None
+
+
+def _source_size(source):
+    """输入项的数据大小: 文件路径取文件大小，(分片路径, 偏移, 长度) 取长度"""
+    if isinstance(source, tuple):
+        return source[2]
+    try:
+        return os.path.getsize(source)
+    except OSError:
+        return 0
+
+
+def _balanced_chunks(sizes, chunk_count):
+    """按数据大小把输入分成 chunk_count 组(LPT: 从大到小依次放入当前总量最小的组)，每组内保持输入顺序"""
+    heap = [(0, chunk) for chunk in range(chunk_count)]
+    chunks = [[] for _ in range(chunk_count)]
+    for index in sorted(range(len(sizes)), key=lambda i: -sizes[i]):
+        total, chunk = heapq.heappop(heap)
+        chunks[chunk].append(index)
+        heapq.heappush(heap, (total + sizes[index], chunk))
+    return [sorted(chunk) for chunk in chunks if chunk]
+
+
+def _parse_chunk(tasks, fields):
+    """进程池入口: 解码一组分段，合并为一个 DanmakuBatch；按当前的protobuf实现选择更快的解码方式"""
+    builder = DanmakuBatchBuilder(fields)
+    shard_maps = {}
+    
+    # decode_segment 只比纯Python实现的protobuf快；upb/cpp 实现由C代码解析消息，再按列读取字段更快
+    if DanmakuParser.protobuf_backend() == "python":
+        def append(data, file_index):
+            builder.append(decode_segment(data, fields), file_index)
+    else:
+        parse_reply = DanmakuParser.load_schema().DmSegMobileReply.FromString
+        
+        def append(data, file_index):
+            builder.append_message(parse_reply(data), file_index)
+    
+    try:
+        for file_index, source in tasks:
+            try:
+                if isinstance(source, tuple):
+                    # 打包存储中的分段: 映射整个分片文件，解码其中的切片
+                    shard_path, offset, length = source
+                    mapped = shard_maps.get(shard_path)
+                    if mapped is None and length:
+                        with open(shard_path, 'rb') as f:
+                            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                        shard_maps[shard_path] = mapped
+                    data = memoryview(mapped)[offset:offset + length] if length else b""
+                    append(data, file_index)
+                else:
+                    with DanmakuParser.open_segment(source) as data:
+                        append(data, file_index)
+            except Exception as e:
+                builder.add_error(file_index, str(e))
+    finally:
+        for mapped in shard_maps.values():
+            try:
+                mapped.close()
+            except BufferError:
+                pass
+    return builder.build()
 
-# 导入protobuf模块
-import dm_pb2 as Danmaku
 
 class DanmakuParser:
+    @staticmethod
+    def protobuf_backend():
+        """返回当前使用的protobuf实现: upb、cpp 或 python"""
+        from google.protobuf.internal import api_implementation
+        return api_implementation.Type()
+    
+    @staticmethod
+    def backend_message():
+        """返回描述当前protobuf实现的提示，回退到纯Python实现时为警告内容"""
+        backend = DanmakuParser.protobuf_backend()
+        if backend == "python":
+            return ("protobuf 使用纯Python实现，解析速度会慢一个数量级；"
+                    "请安装较新的 protobuf 并检查 PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION 环境变量")
+        return f"protobuf 实现: {backend}"
+    
+    @staticmethod
+    def load_schema():
+        """首次解析时才导入精简的protobuf定义(dm_slim_pb2)，只导入解析器的脚本和子进程不需要加载protobuf"""
+        global _schema
+        if _schema is None:
+            import dm_slim_pb2
+            _schema = dm_slim_pb2
+            
+            # 不同实现的解析速度相差一个数量级，加载时报告实际使用的实现
+            if DanmakuParser.protobuf_backend() == "python":
+                logger.warning(DanmakuParser.backend_message())
+            else:
+                logger.info(DanmakuParser.backend_message())
+        return _schema
+    
+    @staticmethod
+    @contextlib.contextmanager
+    def open_segment(bin_file_path):
+        """
+        打开弹幕文件并产出其数据: 大文件(不小于 MMAP_MIN_SIZE)以内存映射方式产出只读的memoryview，
+        不把文件内容复制到新的bytes对象中；小文件直接读取；空文件产出 b""。
+        产出的数据只在 with 块内有效，块结束时解除映射
+        """
+        with open(bin_file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0 or size < MMAP_MIN_SIZE:  # 空文件无法映射
+                yield f.read()
+                return
+            
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(mapped)
+            try:
+                yield view
+            finally:
+                try:
+                    view.release()
+                    mapped.close()
+                except BufferError:
+                    pass  # 调用方仍持有数据的切片，等切片释放后由垃圾回收解除映射
+    
     @staticmethod
     def parse_danmaku_bin(bin_file_path):
         """解析单个弹幕二进制文件并返回解析结果"""
         try:
-            # 读取二进制文件
-            with open(bin_file_path, 'rb') as f:
-                binary_data = f.read()
-            
+            # 大文件内存映射读取，解析时直接使用映射的数据
+            with DanmakuParser.open_segment(bin_file_path) as binary_data:
+                return DanmakuParser.parse_danmaku_bytes(binary_data)
+        except Exception as e:
+            print(f"解析弹幕文件时出错: {str(e)}")
+            return None
+    
+    @staticmethod
+    def parse_danmaku_bytes(binary_data):
+        """解析单个分段的原始弹幕数据并返回解析结果"""
+        try:
             # 解析protobuf数据
-            danmaku_seg = Danmaku.DmSegMobileReply()
+            danmaku_seg = DanmakuParser.load_schema().DmSegMobileReply()
             danmaku_seg.ParseFromString(binary_data)
             
             # 返回解析结果
@@ -25,6 +161,60 @@ class DanmakuParser:
             print(f"解析弹幕文件时出错: {str(e)}")
             return None
     
+    @staticmethod
+    def parse_many(sources, workers=None, fields=DEFAULT_FIELDS, show_progress=False):
+        """
+        用进程池批量解码弹幕分段，返回按列的 DanmakuBatch 列表，而不是逐条的protobuf对象
+
+        参数:
+            sources: 弹幕文件路径，或打包存储中分段的 (分片路径, 偏移, 长度)(见 SegmentPackReader.locate)
+            workers: 进程数，默认为CPU核数；为1时在当前进程中解码
+            fields: 需要解码的字段，见 danmaku_fast_decoder
+            show_progress: 是否显示进度条
+        
+        返回:
+            List[DanmakuBatch]: 每批的 file_index 列指向 sources 中的位置，顺序与输入不同
+        """
+        sources = list(sources)
+        if not sources:
+            return []
+        workers = workers or os.cpu_count() or 1
+        fields = tuple(fields)
+        
+        # 按数据大小均衡分组，组数多于进程数，先完成的进程继续领取剩下的组
+        chunk_count = 1 if workers == 1 else min(len(sources), workers * 4)
+        chunks = _balanced_chunks([_source_size(source) for source in sources], chunk_count)
+        tasks = [[(index, sources[index]) for index in chunk] for chunk in chunks]
+        
+        progress = tqdm(total=len(sources), desc="解析弹幕", disable=not show_progress)
+        batches = []
+        if workers == 1:
+            for chunk in tasks:
+                batches.append(_parse_chunk(chunk, fields))
+                progress.update(len(chunk))
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(_parse_chunk, chunk, fields): len(chunk) for chunk in tasks}
+                for future in concurrent.futures.as_completed(futures):
+                    batches.append(future.result())
+                    progress.update(futures[future])
+        progress.close()
+        
+        for batch in batches:
+            for file_index, message in batch.errors:
+                print(f"解析弹幕文件时出错 {sources[file_index]}: {message}")
+        return batches
+    
+    @staticmethod
+    def parse_packed_segment(pack_reader, cid, segment_index):
+        """从打包存储(SegmentPackReader)中读取并解析指定分段，直接解析分片文件映射中的切片"""
+        binary_data = pack_reader.get_view(cid, segment_index)
+        if binary_data is None:
+            print(f"打包存储中不存在该分段: CID {cid}, 分段 {segment_index}")
+            return None
+        
+        return DanmakuParser.parse_danmaku_bytes(binary_data)
+    
     @staticmethod
     def print_danmaku_info(danmaku_seg, limit=10):
         """打印弹幕信息摘要"""
@@ -53,6 +243,9 @@ def main():
     
     bin_file_path = sys.argv[1]
     
+    # 只有爬虫配置了日志输出: 纯Python实现的警告仍会输出到stderr，其他实现的信息在这里打印
+    if DanmakuParser.protobuf_backend() != "python":
+        print(DanmakuParser.backend_message())
     parser = DanmakuParser()
     danmaku_seg = parser.parse_danmaku_bin(bin_file_path)
     
@@ -0,0 +1,124 @@
+# disk_writer.py
+import os
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from crawler_log import get_logger
+
+logger = get_logger("disk_writer")
+
+
+def write_bytes(path, data, fsync=False):
+    """写入二进制文件"""
+    with open(path, 'wb') as f:
+        f.write(data)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def write_json(path, obj, fsync=False):
+    """写入JSON文件"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class DiskWriter:
+    """
+    磁盘写入器: 所有磁盘操作进入有界队列，由一个专用线程按提交顺序分批执行，
+    事件循环不再被文件写入阻塞；队列写满时提交方等待，在磁盘跟不上时对爬取形成背压
+    """
+
+    def __init__(self, max_pending=256, batch_size=64):
+        self.max_pending = max_pending    # 队列中最多等待的操作数
+        self.batch_size = batch_size      # 每批最多执行的操作数
+        self.error_count = 0
+        self.failed_keys = set()          # 执行失败的无需等待结果的操作所标记的键
+        self._queue = None
+        self._task = None
+        self._batch_callbacks = []
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="disk-writer")
+
+    def add_batch_callback(self, callback):
+        """注册每批操作执行完后调用的函数(在写入线程中执行)，例如统一刷新或fsync分片文件"""
+        self._batch_callbacks.append(callback)
+
+    def start(self):
+        """在当前事件循环中启动写入任务"""
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._task = asyncio.create_task(self._run())
+
+    @property
+    def pending(self):
+        """当前排队等待执行的操作数"""
+        return self._queue.qsize() if self._queue else 0
+
+    async def submit(self, func, *args, key=None):
+        """
+        提交一个无需等待结果的操作，只在队列已满时等待；
+        指定 key 时操作失败会把 key 记入 failed_keys，供之后的操作或调用方检查
+        """
+        await self._queue.put((func, args, None, key))
+
+    async def call(self, func, *args):
+        """提交一个操作并等待其执行结果"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((func, args, future, None))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            batch = []
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= self.batch_size or self._queue.empty():
+                    break
+                item = self._queue.get_nowait()
+            stopping = item is None
+
+            if batch:
+                results = await loop.run_in_executor(self._executor, self._execute_batch, batch)
+                for (_, _, future, _), (ok, value) in zip(batch, results):
+                    if future is None or future.done():
+                        continue
+                    if ok:
+                        future.set_result(value)
+                    else:
+                        future.set_exception(value)
+
+    def _execute_batch(self, batch):
+        """在写入线程中依次执行一批操作，然后调用批处理回调"""
+        results = []
+        for func, args, future, key in batch:
+            try:
+                results.append((True, func(*args)))
+            except Exception as e:
+                results.append((False, e))
+                if future is None:
+                    # 无人等待结果的操作只能在这里报告错误
+                    self.error_count += 1
+                    if key is not None:
+                        self.failed_keys.add(key)
+                    logger.error("  磁盘写入失败: %s", str(e)[:100])
+
+        for callback in self._batch_callbacks:
+            try:
+                callback()
+            except Exception as e:
+                self.error_count += 1
+                logger.error("  磁盘写入失败: %s", str(e)[:100])
+        return results
+
+    async def close(self):
+        """等待已提交的操作全部执行完毕后停止"""
+        if self._task is not None:
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+        self._executor.shutdown(wait=True)
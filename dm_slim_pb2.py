@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# dm_slim_pb2.py
+# 精简的弹幕protobuf定义: 只包含解析 seg.so 和 view 接口响应所需的消息，
+# 字段号与类型与 dm_pb2.py 一致；其余字段在解析时作为未知字段保留。
+# 注册在独立的 DescriptorPool 中，可以与 dm_pb2 同时导入而不冲突。
+
+from google.protobuf import descriptor_pb2
+from google.protobuf import descriptor_pool
+from google.protobuf import message_factory
+
+PACKAGE = 'bilibili.community.service.dm.v1'
+
+_FieldProto = descriptor_pb2.FieldDescriptorProto
+
+# 消息名 -> [(字段名, 字段号, 类型, 是否repeated, 消息类型名)]
+_MESSAGES = {
+    'DanmakuElem': [
+        ('id', 1, _FieldProto.TYPE_INT64, False, None),
+        ('progress', 2, _FieldProto.TYPE_INT32, False, None),
+        ('mode', 3, _FieldProto.TYPE_INT32, False, None),
+        ('fontsize', 4, _FieldProto.TYPE_INT32, False, None),
+        ('color', 5, _FieldProto.TYPE_UINT32, False, None),
+        ('midHash', 6, _FieldProto.TYPE_STRING, False, None),
+        ('content', 7, _FieldProto.TYPE_STRING, False, None),
+        ('ctime', 8, _FieldProto.TYPE_INT64, False, None),
+        ('weight', 9, _FieldProto.TYPE_INT32, False, None),
+        ('action', 10, _FieldProto.TYPE_STRING, False, None),
+        ('pool', 11, _FieldProto.TYPE_INT32, False, None),
+        ('idStr', 12, _FieldProto.TYPE_STRING, False, None),
+        ('attr', 13, _FieldProto.TYPE_INT32, False, None),
+        ('animation', 22, _FieldProto.TYPE_STRING, False, None),
+    ],
+    'DanmakuFlag': [
+        ('dmid', 1, _FieldProto.TYPE_INT64, False, None),
+        ('flag', 2, _FieldProto.TYPE_UINT32, False, None),
+    ],
+    'DanmakuAIFlag': [
+        ('dm_flags', 1, _FieldProto.TYPE_MESSAGE, True, 'DanmakuFlag'),
+    ],
+    'DmSegMobileReply': [
+        ('elems', 1, _FieldProto.TYPE_MESSAGE, True, 'DanmakuElem'),
+        ('state', 2, _FieldProto.TYPE_INT32, False, None),
+        ('ai_flag', 3, _FieldProto.TYPE_MESSAGE, False, 'DanmakuAIFlag'),
+    ],
+    'DmSegConfig': [
+        ('page_size', 1, _FieldProto.TYPE_INT64, False, None),
+        ('total', 2, _FieldProto.TYPE_INT64, False, None),
+    ],
+    # view 接口只用到分段配置，播放器配置、指令弹幕等字段不定义
+    'DmWebViewReply': [
+        ('state', 1, _FieldProto.TYPE_INT32, False, None),
+        ('text', 2, _FieldProto.TYPE_STRING, False, None),
+        ('text_side', 3, _FieldProto.TYPE_STRING, False, None),
+        ('dm_sge', 4, _FieldProto.TYPE_MESSAGE, False, 'DmSegConfig'),
+        ('count', 8, _FieldProto.TYPE_INT64, False, None),
+    ],
+}
+
+
+def _build_file_proto():
+    file_proto = descriptor_pb2.FileDescriptorProto(name='dm_slim.proto', package=PACKAGE, syntax='proto3')
+    for message_name, fields in _MESSAGES.items():
+        message_proto = file_proto.message_type.add(name=message_name)
+        for name, number, field_type, repeated, type_name in fields:
+            field_proto = message_proto.field.add(
+                name=name,
+                number=number,
+                type=field_type,
+                label=_FieldProto.LABEL_REPEATED if repeated else _FieldProto.LABEL_OPTIONAL
+            )
+            if type_name:
+                field_proto.type_name = f'.{PACKAGE}.{type_name}'
+    return file_proto
+
+
+def _message_class(descriptor):
+    if hasattr(message_factory, 'GetMessageClass'):
+        return message_factory.GetMessageClass(descriptor)
+    return message_factory.MessageFactory(descriptor.file.pool).GetPrototype(descriptor)  # protobuf < 4.21
+
+
+_pool = descriptor_pool.DescriptorPool()
+_pool.AddSerializedFile(_build_file_proto().SerializeToString())
+DESCRIPTOR = _pool.FindFileByName('dm_slim.proto')
+
+DanmakuElem = _message_class(DESCRIPTOR.message_types_by_name['DanmakuElem'])
+DanmakuFlag = _message_class(DESCRIPTOR.message_types_by_name['DanmakuFlag'])
+DanmakuAIFlag = _message_class(DESCRIPTOR.message_types_by_name['DanmakuAIFlag'])
+DmSegMobileReply = _message_class(DESCRIPTOR.message_types_by_name['DmSegMobileReply'])
+DmSegConfig = _message_class(DESCRIPTOR.message_types_by_name['DmSegConfig'])
+DmWebViewReply = _message_class(DESCRIPTOR.message_types_by_name['DmWebViewReply'])
@@ -0,0 +1,183 @@
+# fake_seg_server.py
+import os
+import glob
+import random
+import asyncio
+import collections
+from aiohttp import web
+import dm_slim_pb2 as Danmaku
+
+
+class FakeSegServer:
+    """
+    本地模拟弹幕接口，用于在不访问B站的情况下压测爬虫:
+    /x/v2/dm/web/seg.so 返回合成的(或录制的)DmSegMobileReply，
+    /x/v2/dm/web/view 返回带分段总数的DmWebViewReply；
+    响应延迟服从对数正态分布，并可按比例注入412、5xx和超时
+    """
+
+    def __init__(self, host="127.0.0.1", port=18080, segment_range=(1, 5), danmaku_per_segment=300,
+                 latency_median=0.05, latency_sigma=0.5, throttle_rate=0.0, server_error_rate=0.0,
+                 timeout_rate=0.0, timeout_seconds=30.0, recorded_dir=None, payload_variants=16, seed=0):
+        """
+        初始化模拟服务器
+
+        参数:
+            host, port: 监听地址
+            segment_range: 每个视频的分段数范围 (最少, 最多)，同一cid的分段数固定
+            danmaku_per_segment: 合成分段中的弹幕条数
+            latency_median: 响应延迟的中位数(秒)
+            latency_sigma: 对数正态分布的sigma，越大长尾越明显
+            throttle_rate: 返回412的请求比例
+            server_error_rate: 返回503的请求比例
+            timeout_rate: 不响应(直到 timeout_seconds 后才返回)的请求比例
+            timeout_seconds: 模拟超时请求的挂起时间，应大于爬虫的 request_timeout
+            recorded_dir: 录制的分段目录(爬虫保存的 segment_*.bin)，设置后返回录制的数据而不是合成数据
+            payload_variants: 预先生成的合成分段数量
+            seed: 随机数种子
+        """
+        self.host = host
+        self.port = port
+        self.segment_range = segment_range
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.throttle_rate = throttle_rate
+        self.server_error_rate = server_error_rate
+        self.timeout_rate = timeout_rate
+        self.timeout_seconds = timeout_seconds
+        self.seed = seed
+        self._random = random.Random(seed)
+        self.stats = collections.Counter()
+        self._runner = None
+
+        # 响应内容在启动前生成好，避免服务器自身的protobuf序列化影响压测结果
+        if recorded_dir:
+            self.payloads = self._load_recorded(recorded_dir)
+        else:
+            self.payloads = [self._build_payload(variant, danmaku_per_segment) for variant in range(payload_variants)]
+
+    @staticmethod
+    def _load_recorded(recorded_dir):
+        payloads = []
+        for path in sorted(glob.glob(os.path.join(recorded_dir, "**", "segment_*.bin"), recursive=True)):
+            with open(path, 'rb') as f:
+                data = f.read()
+            if data:
+                payloads.append(data)
+        if not payloads:
+            raise ValueError(f"目录中没有录制的分段数据: {recorded_dir}")
+        return payloads
+
+    def _build_payload(self, variant, danmaku_count):
+        """生成一个合成的弹幕分段"""
+        rng = random.Random(self.seed * 1000 + variant)
+        reply = Danmaku.DmSegMobileReply()
+        for index in range(danmaku_count):
+            elem = reply.elems.add()
+            elem.id = rng.getrandbits(62)
+            elem.idStr = str(elem.id)
+            elem.progress = rng.randrange(0, 360000)
+            elem.mode = rng.choice((1, 1, 1, 4, 5))
+            elem.fontsize = 25
+            elem.color = rng.choice((16777215, 16707842, 65532))
+            elem.midHash = f"{rng.getrandbits(32):08x}"
+            elem.content = f"模拟弹幕{variant}-{index}" + "哈" * rng.randrange(0, 20)
+            elem.ctime = 1700000000 + rng.randrange(0, 30000000)
+            elem.weight = rng.randrange(1, 11)
+            elem.pool = 0
+        return reply.SerializeToString()
+
+    def segment_count(self, cid):
+        """同一cid的分段数固定"""
+        return random.Random(cid).randint(*self.segment_range)
+
+    async def _simulate(self):
+        """模拟网络延迟和错误注入，返回需要直接返回的错误响应，正常时返回None"""
+        roll = self._random.random()
+        if roll < self.timeout_rate:
+            self.stats['timeout'] += 1
+            await asyncio.sleep(self.timeout_seconds)
+            return web.Response(status=504)
+
+        await asyncio.sleep(self._random.lognormvariate(0, self.latency_sigma) * self.latency_median)
+
+        roll -= self.timeout_rate
+        if roll < self.throttle_rate:
+            self.stats[412] += 1
+            return web.Response(status=412)
+        roll -= self.throttle_rate
+        if roll < self.server_error_rate:
+            self.stats[503] += 1
+            return web.Response(status=503, headers={'Retry-After': '1'})
+        return None
+
+    async def _handle_segment(self, request):
+        error = await self._simulate()
+        if error is not None:
+            return error
+
+        cid = int(request.query.get('oid', 0))
+        segment_index = int(request.query.get('segment_index', 1))
+        self.stats[200] += 1
+        if segment_index > self.segment_count(cid):
+            return web.Response(body=b"", content_type="application/octet-stream")
+        payload = self.payloads[hash((cid, segment_index)) % len(self.payloads)]
+        self.stats['bytes'] += len(payload)
+        return web.Response(body=payload, content_type="application/octet-stream")
+
+    async def _handle_view(self, request):
+        error = await self._simulate()
+        if error is not None:
+            return error
+
+        reply = Danmaku.DmWebViewReply()
+        reply.dm_sge.page_size = 360000
+        reply.dm_sge.total = self.segment_count(int(request.query.get('oid', 0)))
+        self.stats[200] += 1
+        return web.Response(body=reply.SerializeToString(), content_type="application/octet-stream")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/x/v2/dm/web/seg.so", self._handle_segment)
+        app.router.add_get("/x/v2/dm/web/view", self._handle_view)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+
+async def serve_forever(server):
+    await server.start()
+    print(f"模拟弹幕接口已启动: {server.base_url}，每段 {len(server.payloads[0])} 字节左右")
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await server.stop()
+
+
+def main():
+    # 根据实际情况修改: 监听端口、延迟分布和错误注入比例
+    server = FakeSegServer(
+        port=18080,
+        latency_median=0.05,
+        throttle_rate=0.01,
+        server_error_rate=0.01,
+        timeout_rate=0.002
+    )
+    try:
+        asyncio.run(serve_forever(server))
+    except KeyboardInterrupt:
+        print(f"\n已停止，请求统计: {dict(server.stats)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,41 @@
 # headers_pool.py
 import random
-from typing import Dict, List
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Sequence
+
+# 禁用缓存的请求头，爬取弹幕时附加到每个请求头配置上
+NO_CACHE_HEADERS = {
+    'Cache-Control': 'no-cache, no-store, must-revalidate',
+    'Pragma': 'no-cache',
+    'Expires': '0'
+}
 
 class HeadersPool:
     """
     请求头池类，管理标准浏览器的请求头配置，
     用于网络请求伪装，提高爬虫请求的成功率
+    
+    所有请求头在初始化时构建为只读映射，可以直接附加到每个请求上，
+    使用方无法修改池中的配置
     """
     
-    def __init__(self):
-        """初始化请求头池，加载所有预定义的请求头配置"""
-        self._headers_pool = self._initialize_pool()
+    def __init__(self, extra_headers: Optional[Mapping[str, str]] = None,
+                 weights: Optional[Sequence[float]] = None):
+        """
+        初始化请求头池，加载所有预定义的请求头配置
+        
+        参数:
+            extra_headers: 附加到每个请求头配置上的请求头(同名时覆盖)
+            weights: 每个请求头配置被选中的相对权重，默认相同
+        """
+        extra_headers = dict(extra_headers or {})
+        self._headers_pool = [
+            MappingProxyType({**headers, **extra_headers}) for headers in self._initialize_pool()
+        ]
+        if weights is not None and len(weights) != len(self._headers_pool):
+            raise ValueError(f"权重数量({len(weights)})与请求头配置数量({len(self._headers_pool)})不一致")
+        self._weights = list(weights) if weights is not None else None
+        self._sticky: Dict[str, Mapping[str, str]] = {}
     
     def _initialize_pool(self) -> List[Dict[str, str]]:
         """初始化并返回精简且标准的请求头池"""
@@ -115,11 +140,26 @@ class HeadersPool:
             }
         ]
 
-    def get_random_headers(self) -> Dict[str, str]:
+    def get_random_headers(self) -> Mapping[str, str]:
+        """
+        按权重随机返回一个请求头配置
+        
+        返回:
+            Mapping[str, str]: 随机选择的请求头配置(只读)
+        """
+        if self._weights is None:
+            return random.choice(self._headers_pool)
+        return random.choices(self._headers_pool, weights=self._weights)[0]
+    
+    def get_headers(self, key: str) -> Mapping[str, str]:
         """
-        随机返回一个请求头配置
+        返回与 key (例如代理地址) 绑定的请求头配置，首次使用时按权重随机选择，
+        之后同一个 key 总是使用同一身份
         
         返回:
-            Dict[str, str]: 随机选择的请求头配置
+            Mapping[str, str]: 绑定的请求头配置(只读)
         """
-        return random.choice(self._headers_pool)
\ No newline at end of file
+        headers = self._sticky.get(key)
+        if headers is None:
+            headers = self._sticky[key] = self.get_random_headers()
+        return headers
\ No newline at end of file
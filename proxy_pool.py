@@ -0,0 +1,194 @@
+# proxy_pool.py
+import time
+import random
+import asyncio
+import aiohttp
+from crawler_log import get_logger
+
+logger = get_logger("proxy_pool")
+
+# 健康检查默认请求的接口，未登录时也会正常返回
+DEFAULT_TEST_URL = "https://api.bilibili.com/x/web-interface/nav"
+
+# 代理认证失败(407)或出口IP被限流(412/429)，说明该代理当前不可用
+PROXY_FAILURE_STATUSES = frozenset({407, 412, 429})
+
+
+def proxy_response_ok(status):
+    """通过代理收到该状态码的响应时，代理是否可用；爬取请求和健康检查使用同一判断"""
+    return status < 500 and status not in PROXY_FAILURE_STATUSES
+
+
+def build_proxy_url(proxy_config):
+    """将代理配置 {host, port, user, pass} 转换为代理URL"""
+    if proxy_config.get('user'):
+        return f"http://{proxy_config['user']}:{proxy_config['pass']}@{proxy_config['host']}:{proxy_config['port']}"
+    return f"http://{proxy_config['host']}:{proxy_config['port']}"
+
+
+class ProxyStats:
+    """单个代理的健康状态: 延迟和错误率的指数加权移动平均(EWMA)、在途请求数和隔离状态"""
+
+    def __init__(self, proxy_config, max_concurrency):
+        self.url = build_proxy_url(proxy_config)
+        self.name = f"{proxy_config['host']}:{proxy_config['port']}"  # 日志中不显示账号密码
+        self.max_concurrency = max_concurrency
+        self.latency = None       # 成功请求耗时的EWMA(秒)
+        self.error_rate = 0.0     # 失败率的EWMA
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.samples = 0          # 上次恢复使用以来完成的请求数
+        self.quarantined_until = 0.0
+        self.quarantine_duration = 0.0
+        self.quarantine_count = 0
+
+    @property
+    def quarantined(self):
+        return self.quarantined_until > 0
+
+    def weight(self):
+        """选择权重: 错误率越低、延迟越低权重越高"""
+        latency = self.latency if self.latency is not None else 1.0
+        return max(0.01, (1.0 - self.error_rate) ** 2) / max(latency, 0.05)
+
+
+class ProxyPool:
+    """
+    代理池: 按健康状况加权随机选择代理，每个代理有并发请求数上限；
+    错误率过高的代理被隔离，由后台任务定期重新测试，测试通过后恢复使用
+
+    没有配置代理时 acquire 返回 None，请求直接发出
+    """
+
+    def __init__(self, proxy_configs, max_concurrency=10, alpha=0.2, error_threshold=0.5, min_requests=5,
+                 quarantine_time=60.0, max_quarantine_time=900.0, test_url=DEFAULT_TEST_URL, test_timeout=10):
+        """
+        初始化代理池
+
+        参数:
+            proxy_configs: 代理配置列表，每项格式为 {host, port, user, pass}
+            max_concurrency: 每个代理同时进行的请求数上限
+            alpha: EWMA的平滑系数，越大越看重最近的请求
+            error_threshold: 错误率EWMA超过此值时隔离代理
+            min_requests: 代理至少完成这么多请求后才可能被隔离
+            quarantine_time: 首次隔离的时长(秒)，重新测试失败时加倍
+            max_quarantine_time: 隔离时长上限(秒)
+            test_url: 重新测试隔离代理时请求的地址
+            test_timeout: 测试请求的超时时间(秒)
+        """
+        self.proxies = [ProxyStats(proxy_config, max_concurrency) for proxy_config in proxy_configs]
+        self.alpha = alpha
+        self.error_threshold = error_threshold
+        self.min_requests = min_requests
+        self.quarantine_time = quarantine_time
+        self.max_quarantine_time = max_quarantine_time
+        self.test_url = test_url
+        self.test_timeout = test_timeout
+        self._released = None
+
+    @property
+    def available_count(self):
+        """未被隔离的代理数"""
+        return sum(1 for proxy in self.proxies if not proxy.quarantined)
+
+    async def acquire(self):
+        """选择一个代理并占用一个并发名额，所有代理都已满载时等待；没有配置代理时返回None"""
+        if not self.proxies:
+            return None
+        if self._released is None:
+            self._released = asyncio.Event()
+
+        while True:
+            candidates = [
+                proxy for proxy in self.proxies
+                if not proxy.quarantined and proxy.in_flight < proxy.max_concurrency
+            ]
+            if candidates:
+                proxy = random.choices(candidates, weights=[proxy.weight() for proxy in candidates])[0]
+                proxy.in_flight += 1
+                return proxy
+
+            # 等待某个代理释放名额或结束隔离
+            self._released.clear()
+            try:
+                await asyncio.wait_for(self._released.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self, proxy, success, latency=None):
+        """归还并发名额并更新代理的健康状态"""
+        if proxy is None:
+            return
+        proxy.in_flight -= 1
+        proxy.requests += 1
+        proxy.samples += 1
+        if not success:
+            proxy.failures += 1
+
+        proxy.error_rate += self.alpha * ((0.0 if success else 1.0) - proxy.error_rate)
+        if success and latency is not None:
+            proxy.latency = latency if proxy.latency is None else proxy.latency + self.alpha * (latency - proxy.latency)
+
+        if (not proxy.quarantined and proxy.samples >= self.min_requests
+                and proxy.error_rate > self.error_threshold and self.available_count > 1):
+            # 至少保留一个代理可用，所有代理都出错时通常是接口本身的问题，交给熔断器处理
+            proxy.quarantine_duration = min(max(proxy.quarantine_duration * 2, self.quarantine_time),
+                                            self.max_quarantine_time)
+            proxy.quarantined_until = time.monotonic() + proxy.quarantine_duration
+            proxy.quarantine_count += 1
+            logger.warning("代理 %s 错误率 %.0f%%，隔离 %.0f 秒", proxy.name, proxy.error_rate * 100,
+                           proxy.quarantine_duration)
+
+        if self._released is not None:
+            self._released.set()
+
+    async def test_proxy(self, session, proxy):
+        """通过代理请求测试地址，返回是否可用"""
+        try:
+            async with session.get(
+                self.test_url,
+                proxy=proxy.url,
+                timeout=aiohttp.ClientTimeout(total=self.test_timeout)
+            ) as response:
+                await response.read()
+                return proxy_response_ok(response.status)
+        except Exception:
+            return False
+
+    async def run_health_checks(self, session, interval=5.0):
+        """后台任务: 定期重新测试隔离期已到的代理，通过后恢复使用，失败则延长隔离"""
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for proxy in self.proxies:
+                if not proxy.quarantined or proxy.quarantined_until > now:
+                    continue
+
+                if await self.test_proxy(session, proxy):
+                    # 恢复时重置错误率，保留隔离时长以便再次出错时加倍
+                    proxy.quarantined_until = 0.0
+                    proxy.error_rate = 0.0
+                    proxy.samples = 0
+                    logger.info("代理 %s 重新测试通过，恢复使用", proxy.name)
+                    if self._released is not None:
+                        self._released.set()
+                else:
+                    proxy.quarantine_duration = min(proxy.quarantine_duration * 2, self.max_quarantine_time)
+                    proxy.quarantined_until = time.monotonic() + proxy.quarantine_duration
+                    logger.info("代理 %s 重新测试失败，继续隔离 %.0f 秒", proxy.name, proxy.quarantine_duration)
+
+    def summary(self):
+        """返回每个代理的统计信息"""
+        return [
+            {
+                'proxy': proxy.name,
+                'requests': proxy.requests,
+                'failures': proxy.failures,
+                'error_rate': round(proxy.error_rate, 3),
+                'latency': round(proxy.latency, 3) if proxy.latency is not None else None,
+                'quarantined': proxy.quarantined,
+                'quarantine_count': proxy.quarantine_count
+            }
+            for proxy in self.proxies
+        ]
@@ -0,0 +1,175 @@
+# retry_policy.py
+import time
+import random
+import asyncio
+import collections
+import email.utils
+from crawler_log import get_logger
+
+logger = get_logger("retry_policy")
+
+# 响应状态分类
+SUCCESS = "success"        # 成功
+THROTTLED = "throttled"    # 被限流或触发反爬，需要较长的退避
+RETRYABLE = "retryable"    # 服务器错误或网络异常，可以重试
+PERMANENT = "permanent"    # 资源不存在(404/410)，返回空内容
+REJECTED = "rejected"      # 请求被拒绝(如400)，重试也不会成功，但不能当作资源不存在
+
+
+class RetryPolicy:
+    """
+    按状态码类别决定是否重试，并计算去相关抖动(decorrelated jitter)的指数退避时间:
+    每次等待在 [基础时间, 上次等待 x 3] 之间随机取值，各工作协程的重试时刻自然错开，
+    不会在封禁潮中同步重试；响应带有 Retry-After 时至少等待其指定的时间
+    """
+
+    THROTTLE_STATUSES = frozenset({412, 429})
+    # 未授权、禁止访问和代理认证失败通常是账号或IP被封禁，按限流处理，不能当作资源不存在
+    BLOCKED_STATUSES = frozenset({401, 403, 407})
+    ABSENT_STATUSES = frozenset({404, 410})
+
+    def __init__(self, base_delay=0.5, max_delay=60.0, throttle_base_delay=5.0):
+        """
+        初始化重试策略
+
+        参数:
+            base_delay: 普通错误的最短退避时间(秒)
+            max_delay: 退避时间上限(秒)
+            throttle_base_delay: 被限流或封禁(412/429/401/403/407)时的最短退避时间(秒)
+        """
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.throttle_base_delay = throttle_base_delay
+
+    def classify(self, status=None):
+        """对响应状态码分类，status 为 None 表示请求异常(超时、连接错误等)"""
+        if status is None:
+            return RETRYABLE
+        if 200 <= status < 300:
+            return SUCCESS
+        if status in self.THROTTLE_STATUSES or status in self.BLOCKED_STATUSES:
+            return THROTTLED
+        if status >= 500 or status == 408:
+            return RETRYABLE
+        if status in self.ABSENT_STATUSES:
+            return PERMANENT
+        return REJECTED
+
+    @staticmethod
+    def parse_retry_after(value):
+        """解析 Retry-After 头(秒数或HTTP日期)，返回需要等待的秒数，无法解析时返回None"""
+        if not value:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at is None:
+            return None
+        return max(0.0, retry_at.timestamp() - time.time())
+
+    def next_delay(self, previous_delay, outcome, retry_after=None):
+        """根据上次的退避时间计算下次重试前的等待时间"""
+        base = self.throttle_base_delay if outcome == THROTTLED else self.base_delay
+        delay = min(self.max_delay, random.uniform(base, max(base, previous_delay * 3)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+class CircuitBreaker:
+    """
+    熔断器: 在最近 window 个请求中统计失败比例，超过 error_ratio 时打开，所有工作协程的请求
+    暂停 open_duration 秒；之后进入半开状态，只放行一个探测请求，成功则恢复，失败则再次打开且暂停时间加倍
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, window=50, error_ratio=0.5, min_samples=20, open_duration=30.0, max_open_duration=600.0):
+        """
+        初始化熔断器
+
+        参数:
+            window: 统计失败比例的最近请求数
+            error_ratio: 触发熔断的失败比例
+            min_samples: 样本数少于此值时不触发熔断
+            open_duration: 首次熔断的暂停时间(秒)
+            max_open_duration: 连续熔断时暂停时间的上限(秒)
+        """
+        self.window = window
+        self.error_ratio = error_ratio
+        self.min_samples = min_samples
+        self.open_duration = open_duration
+        self.max_open_duration = max_open_duration
+
+        self.state = self.CLOSED
+        self.open_count = 0
+        self._results = collections.deque(maxlen=window)
+        self._failures = 0
+        self._current_duration = open_duration
+        self._open_until = 0.0
+        self._probe_started = 0.0
+
+    async def wait_ready(self):
+        """熔断期间等待，直到允许发出请求"""
+        while True:
+            if self.state == self.CLOSED:
+                return
+
+            now = time.monotonic()
+            if self.state == self.OPEN:
+                if now < self._open_until:
+                    await asyncio.sleep(self._open_until - now)
+                    continue
+                self.state = self.HALF_OPEN
+                self._probe_started = 0.0
+
+            # 由当前请求充当探测请求；探测请求迟迟没有结果(例如被取消)时再放行一个
+            if now - self._probe_started >= self.open_duration:
+                self._probe_started = now
+                return
+            await asyncio.sleep(0.5)  # 等待探测结果
+
+    def record(self, success):
+        """记录一次请求结果"""
+        if self.state == self.HALF_OPEN:
+            if success:
+                logger.info("熔断恢复: 探测请求成功，恢复正常请求")
+                self._reset()
+            else:
+                self._current_duration = min(self._current_duration * 2, self.max_open_duration)
+                self._open()
+                logger.warning("熔断: 探测请求失败，继续暂停所有请求 %.0f 秒", self._current_duration)
+            return
+
+        if self.state == self.OPEN:
+            return  # 熔断前已发出的请求，不计入统计
+
+        if len(self._results) == self._results.maxlen and not self._results[0]:
+            self._failures -= 1
+        self._results.append(success)
+        if not success:
+            self._failures += 1
+
+        ratio = self._failures / len(self._results)
+        if len(self._results) >= self.min_samples and ratio >= self.error_ratio:
+            self._open()
+            logger.warning("熔断: 最近请求失败比例 %.0f%%，暂停所有请求 %.0f 秒", ratio * 100, self._current_duration)
+
+    def _open(self):
+        self.state = self.OPEN
+        self.open_count += 1
+        self._open_until = time.monotonic() + self._current_duration
+        self._results.clear()
+        self._failures = 0
+
+    def _reset(self):
+        self.state = self.CLOSED
+        self._current_duration = self.open_duration
+        self._results.clear()
+        self._failures = 0
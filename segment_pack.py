@@ -0,0 +1,211 @@
+# segment_pack.py
+import os
+import json
+import mmap
+import struct
+from typing import Dict, Iterator, List, Optional, Tuple, Any
+
+# 索引记录: cid(u64) 分段号(u32) 分片文件号(u32) 偏移(u64) 长度(u32)，共28字节
+INDEX_RECORD = struct.Struct('<QIIQI')
+
+# 单个分片文件的默认大小上限(1GB)
+DEFAULT_SHARD_SIZE = 1 << 30
+
+
+def _shard_file_name(writer_id: str, shard_number: int) -> str:
+    return f"{writer_id}-{shard_number:05d}.pack"
+
+
+class SegmentPackWriter:
+    """
+    弹幕分段打包写入器，将原始分段数据依次追加到大分片文件中，
+    并在紧凑的二进制索引中记录 (cid, 分段号) -> (分片文件号, 偏移, 长度)
+
+    同一目录可以有多个写入器(例如多个爬虫进程)，每个写入器必须使用不同的writer_id，
+    各自写入 {writer_id}-00000.pack、{writer_id}.idx 和 {writer_id}.metadata.jsonl
+    """
+
+    def __init__(self, pack_dir: str, writer_id: str = "main", shard_size: int = DEFAULT_SHARD_SIZE):
+        """初始化写入器，继续追加到该写入器最后一个分片文件"""
+        self.pack_dir = pack_dir
+        self.writer_id = writer_id
+        self.shard_size = shard_size
+        os.makedirs(pack_dir, exist_ok=True)
+
+        self._shard_number = self._find_last_shard()
+        self._shard = open(self._shard_path(self._shard_number), 'ab')
+        self._index = open(os.path.join(pack_dir, f"{writer_id}.idx"), 'ab')
+        self._metadata = open(os.path.join(pack_dir, f"{writer_id}.metadata.jsonl"), 'a', encoding='utf-8')
+
+    def _shard_path(self, shard_number: int) -> str:
+        return os.path.join(self.pack_dir, _shard_file_name(self.writer_id, shard_number))
+
+    def _find_last_shard(self) -> int:
+        """查找该写入器已有的最大分片文件号"""
+        prefix = f"{self.writer_id}-"
+        numbers = [
+            int(name[len(prefix):-len(".pack")]) for name in os.listdir(self.pack_dir)
+            if name.startswith(prefix) and name.endswith(".pack") and name[len(prefix):-len(".pack")].isdigit()
+        ]
+        return max(numbers) if numbers else 0
+
+    def _rotate(self) -> None:
+        """当前分片写满后切换到下一个分片文件"""
+        self._shard.close()
+        self._shard_number += 1
+        self._shard = open(self._shard_path(self._shard_number), 'ab')
+
+    def append(self, cid: int, segment_index: int, data: bytes) -> Tuple[int, int, int]:
+        """
+        追加一个分段的原始数据
+
+        返回:
+            Tuple[int, int, int]: (分片文件号, 偏移, 长度)
+        """
+        offset = self._shard.tell()
+        if offset > 0 and offset + len(data) > self.shard_size:
+            self._rotate()
+            offset = 0
+
+        self._shard.write(data)
+        self._index.write(INDEX_RECORD.pack(int(cid), segment_index, self._shard_number, offset, len(data)))
+        return self._shard_number, offset, len(data)
+
+    def write_metadata(self, metadata: Dict[str, Any]) -> None:
+        """追加一条视频元数据(每行一个JSON对象，同一cid以最后一条为准)"""
+        self._metadata.write(json.dumps(metadata, ensure_ascii=False) + '\n')
+
+    def flush(self, fsync: bool = False) -> None:
+        """先刷新分片数据再刷新索引，保证索引指向的数据已经写入"""
+        for f in (self._shard, self._index, self._metadata):
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+
+    def close(self) -> None:
+        """刷新并关闭所有文件"""
+        self.flush()
+        for f in (self._shard, self._index, self._metadata):
+            f.close()
+
+
+class SegmentPackReader:
+    """弹幕分段打包读取器，合并目录下所有写入器的索引，同一分段以最后写入的记录为准"""
+
+    def __init__(self, pack_dir: str):
+        """加载目录下的所有索引文件"""
+        self.pack_dir = pack_dir
+        self._index: Dict[Tuple[int, int], Tuple[str, int, int, int]] = {}
+        self._segments_by_cid: Dict[int, List[int]] = {}
+        self._files: Dict[Tuple[str, int], Any] = {}
+        self._maps: Dict[Tuple[str, int], mmap.mmap] = {}
+        self._load_index()
+
+    def _writer_ids(self, suffix: str) -> List[str]:
+        if not os.path.isdir(self.pack_dir):
+            return []
+        return sorted(name[:-len(suffix)] for name in os.listdir(self.pack_dir) if name.endswith(suffix))
+
+    def _load_index(self) -> None:
+        for writer_id in self._writer_ids(".idx"):
+            with open(os.path.join(self.pack_dir, f"{writer_id}.idx"), 'rb') as f:
+                raw_index = f.read()
+
+            # 进程中断时末尾可能留下不完整的记录，直接忽略
+            usable = len(raw_index) - len(raw_index) % INDEX_RECORD.size
+            shard_sizes: Dict[int, int] = {}
+            for cid, segment_index, shard_number, offset, length in INDEX_RECORD.iter_unpack(raw_index[:usable]):
+                if shard_number not in shard_sizes:
+                    shard_path = os.path.join(self.pack_dir, _shard_file_name(writer_id, shard_number))
+                    shard_sizes[shard_number] = os.path.getsize(shard_path) if os.path.exists(shard_path) else 0
+                # 跳过数据尚未落盘的记录
+                if offset + length > shard_sizes[shard_number]:
+                    continue
+                self._index[(cid, segment_index)] = (writer_id, shard_number, offset, length)
+
+        for cid, segment_index in self._index:
+            self._segments_by_cid.setdefault(cid, []).append(segment_index)
+        for segments in self._segments_by_cid.values():
+            segments.sort()
+
+    def __contains__(self, key: Tuple[int, int]) -> bool:
+        return key in self._index
+
+    def cids(self) -> List[int]:
+        """返回所有包含分段数据的cid"""
+        return list(self._segments_by_cid)
+
+    def segments(self, cid: int) -> List[int]:
+        """返回指定cid已保存的分段号(升序)"""
+        return self._segments_by_cid.get(int(cid), [])
+
+    def get(self, cid: int, segment_index: int) -> Optional[bytes]:
+        """读取指定分段的原始数据，不存在时返回None"""
+        entry = self._index.get((int(cid), segment_index))
+        if entry is None:
+            return None
+
+        writer_id, shard_number, offset, length = entry
+        shard = self._files.get((writer_id, shard_number))
+        if shard is None:
+            shard = open(os.path.join(self.pack_dir, _shard_file_name(writer_id, shard_number)), 'rb')
+            self._files[(writer_id, shard_number)] = shard
+
+        shard.seek(offset)
+        return shard.read(length)
+
+    def locate(self, cid: int, segment_index: int) -> Optional[Tuple[str, int, int]]:
+        """返回指定分段所在的 (分片文件路径, 偏移, 长度)，不存在时返回None"""
+        entry = self._index.get((int(cid), segment_index))
+        if entry is None:
+            return None
+
+        writer_id, shard_number, offset, length = entry
+        return os.path.join(self.pack_dir, _shard_file_name(writer_id, shard_number)), offset, length
+
+    def get_view(self, cid: int, segment_index: int) -> Optional[memoryview]:
+        """
+        返回指定分段在分片文件内存映射中的只读切片，不复制数据；不存在时返回None
+
+        返回的memoryview在 close() 之前有效
+        """
+        entry = self._index.get((int(cid), segment_index))
+        if entry is None:
+            return None
+
+        writer_id, shard_number, offset, length = entry
+        if length == 0:
+            return memoryview(b"")
+        mapped = self._maps.get((writer_id, shard_number))
+        if mapped is None:
+            # 只映射加载索引时已经落盘的部分，之后追加的数据不在索引中
+            with open(os.path.join(self.pack_dir, _shard_file_name(writer_id, shard_number)), 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[(writer_id, shard_number)] = mapped
+
+        return memoryview(mapped)[offset:offset + length]
+
+    def iter_metadata(self) -> Iterator[Dict[str, Any]]:
+        """遍历所有视频元数据，同一cid只返回最后写入的一条"""
+        latest: Dict[Any, Dict[str, Any]] = {}
+        for writer_id in self._writer_ids(".metadata.jsonl"):
+            with open(os.path.join(self.pack_dir, f"{writer_id}.metadata.jsonl"), 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        metadata = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # 中断时写了一半的行
+                    latest[metadata.get('cid')] = metadata
+        return iter(latest.values())
+
+    def close(self) -> None:
+        """关闭已打开的分片文件和内存映射"""
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+        for mapped in self._maps.values():
+            try:
+                mapped.close()
+            except BufferError:
+                pass  # 仍有 get_view 返回的切片在使用，等它们释放后由垃圾回收解除映射
+        self._maps.clear()
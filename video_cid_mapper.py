@@ -40,12 +40,20 @@ class VideoCIDMapper:
             if result['code'] == 0:
                 main_cid = result['data']['cid']
                 all_parts = [
-                    {'part_number': page['page'], 'part_name': page['part'], 'cid': page['cid']}
+                    {'part_number': page['page'], 'part_name': page['part'], 'cid': page['cid'],
+                     'duration': page.get('duration')}
                     for page in result['data'].get('pages', [])
                 ]
+                # 主CID对应分P的时长(秒)，用于预先计算弹幕分段数
+                main_duration = next(
+                    (part['duration'] for part in all_parts if part['cid'] == main_cid),
+                    result['data'].get('duration')
+                )
                 return {
                     'main_cid': main_cid, 
                     'title': result['data'].get('title', ''), 
+                    'duration': main_duration,
+                    'pubdate': result['data'].get('pubdate'),
                     'parts': all_parts if all_parts else None
                 }
             else:
@@ -71,6 +79,9 @@ class VideoCIDMapper:
             with open(self.output_file, 'r', encoding='utf-8') as f:
                 video_cid_map = json.load(f)
         
+        # 已映射的视频(bvid/aid)，同一视频以不同的arcurl再次出现时不重复请求
+        self._mapped_videos = {entry.get('bvid') or entry.get('aid') for entry in video_cid_map.values()}
+        
         # 进度跟踪计数器
         total_files, processed_files, total_videos, processed_videos, failed_videos = 0, 0, 0, 0, 0
         
@@ -134,6 +145,10 @@ class VideoCIDMapper:
                     # 检查arcurl是否已经在映射中
                     if not arcurl or arcurl in video_cid_map:
                         continue
+                    # 同一视频可能以不同的arcurl出现在多个关键词和分类的搜索结果中
+                    video_key = video.get('bvid') or video.get('aid')
+                    if video_key and video_key in self._mapped_videos:
+                        continue
                     
                     total_videos += 1
                     video_id_dict = self.extract_video_id(arcurl)
@@ -147,9 +162,12 @@ class VideoCIDMapper:
                                 'aid': video.get('aid'),
                                 'bvid': video.get('bvid'),
                                 'title': video.get('title'),
+                                'video_review': video.get('video_review'),  # 弹幕数，用于优先级调度
+                                'pubdate': video.get('pubdate'),
                                 'cid_info': cid_info
                             }
                             
+                            self._mapped_videos.add(video_key)
                             processed_videos += 1
                             print(f"      ({processed_videos}/{total_videos}) 已处理: {arcurl} -> CID: {cid_info['main_cid']} (等待 {sleep_time:.2f}秒)")
                             